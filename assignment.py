@@ -0,0 +1,567 @@
+import functools
+import itertools
+import random
+
+# Largest group sampled exactly by counting; bigger groups use the swap chain
+EXACT_SAMPLING_LIMIT = 12
+# Swap chain moves per participant for each draw
+MIXING_STEPS_PER_PERSON = 20
+# Fraction of swap chain moves that rotate along a random alternating cycle
+CYCLE_MOVE_SHARE = 0.02
+
+
+def build_constraints(participants, restrictions, mandates):
+    """Turn restrictions and mandates into per-giver pinned receivers and forbidden sets.
+
+    Returns (pinned, forbidden) where both are indexed by giver position.
+    pinned[i] is the receiver index giver i must gift to (or None), and
+    forbidden[i] is the set of receiver indices giver i can never gift to.
+    Returns None when the mandates alone already make an assignment impossible.
+    """
+    index = {name: i for i, name in enumerate(participants)}
+    n = len(participants)
+    pinned = [None] * n
+    forbidden = [{i} for i in range(n)]
+
+    for giver, restricted in restrictions.items():
+        if giver not in index:
+            continue
+        gi = index[giver]
+        for receiver in restricted:
+            if receiver in index:
+                forbidden[gi].add(index[receiver])
+
+    # Pin mandates first, then propagate: a mandated receiver is off limits for everyone else
+    taken = set()
+    for giver, receiver in mandates.items():
+        if giver not in index:
+            continue
+        if receiver not in index:
+            return None
+        gi, ri = index[giver], index[receiver]
+        if ri in forbidden[gi] or ri in taken:
+            return None
+        pinned[gi] = ri
+        taken.add(ri)
+
+    for gi in range(n):
+        if pinned[gi] is None:
+            forbidden[gi] |= taken
+
+    return pinned, forbidden
+
+
+def _try_augment(start, pinned, forbidden, match_giver, match_receiver):
+    """Search for an augmenting path from an unmatched giver and flip it if found.
+
+    The graph is dense (everyone may gift to almost everyone), so the
+    neighbours of a giver are implied by its forbidden set instead of being
+    stored. Each receiver is visited at most once per search.
+    """
+    unvisited = set(range(len(match_receiver)))
+    parent = {}
+    queue = [start]
+    while queue:
+        next_queue = []
+        for giver in queue:
+            if pinned[giver] is not None:
+                candidates = [pinned[giver]] if pinned[giver] in unvisited else []
+            else:
+                candidates = [r for r in unvisited if r not in forbidden[giver]]
+            for receiver in candidates:
+                unvisited.discard(receiver)
+                parent[receiver] = giver
+                owner = match_receiver[receiver]
+                if owner is None:
+                    # Flip the path back to the start
+                    while receiver is not None:
+                        giver = parent[receiver]
+                        previous = match_giver[giver]
+                        match_giver[giver] = receiver
+                        match_receiver[receiver] = giver
+                        receiver = previous
+                    return True
+                next_queue.append(owner)
+        queue = next_queue
+    return False
+
+
+def find_assignment(participants, restrictions, mandates, rng=None):
+    """Find a random valid assignment, or None if no valid assignment exists.
+
+    The result is a tuple aligned with `participants`: result[i] is the person
+    participants[i] gifts to. Givers are matched to receivers with a randomized
+    greedy pass, and whoever is left over is fixed up with augmenting paths, so
+    None is returned exactly when no valid assignment exists.
+    """
+    rng = rng or random
+    n = len(participants)
+    if n < 2:
+        return None
+
+    constraints = build_constraints(participants, restrictions, mandates)
+    if constraints is None:
+        return None
+    pinned, forbidden = constraints
+
+    match_giver = [None] * n
+    match_receiver = [None] * n
+
+    # Mandates are pinned before anything else is drawn
+    for gi, ri in enumerate(pinned):
+        if ri is not None:
+            match_giver[gi] = ri
+            match_receiver[ri] = gi
+
+    # Pool of free receivers with O(1) removal (swap with last)
+    pool = [ri for ri in range(n) if match_receiver[ri] is None]
+    rng.shuffle(pool)
+
+    def take(pos):
+        ri = pool[pos]
+        last = pool.pop()
+        if pos < len(pool):
+            pool[pos] = last
+        return ri
+
+    givers = [gi for gi in range(n) if pinned[gi] is None]
+    rng.shuffle(givers)
+    leftover = []
+    for gi in givers:
+        chosen = None
+        # A few random probes are enough unless the giver is heavily restricted
+        for _ in range(4):
+            if not pool:
+                break
+            pos = rng.randrange(len(pool))
+            if pool[pos] not in forbidden[gi]:
+                chosen = pos
+                break
+        if chosen is None:
+            for pos, ri in enumerate(pool):
+                if ri not in forbidden[gi]:
+                    chosen = pos
+                    break
+        if chosen is None:
+            leftover.append(gi)
+            continue
+        ri = take(chosen)
+        match_giver[gi] = ri
+        match_receiver[ri] = gi
+
+    for gi in leftover:
+        if not _try_augment(gi, pinned, forbidden, match_giver, match_receiver):
+            return None
+
+    return tuple(participants[ri] for ri in match_giver)
+
+
+def is_valid_assignment(participants, assignment, restrictions, mandates):
+    """Check if an assignment is valid given restrictions and mandates"""
+    if len(assignment) != len(participants) or len(set(assignment)) != len(assignment):
+        return False
+    for giver, receiver in zip(participants, assignment):
+        if giver == receiver:
+            return False
+        if receiver in restrictions.get(giver, ()):
+            return False
+        if giver in mandates and mandates[giver] != receiver:
+            return False
+    return True
+
+
+def enumerate_assignments(participants, restrictions, mandates):
+    """Yield every valid assignment by brute force. Only usable for small groups."""
+    for combination in itertools.permutations(participants):
+        if is_valid_assignment(participants, combination, restrictions, mandates):
+            yield combination
+
+
+def _completion_counter(n, pinned, forbidden):
+    """Return a memoized counter of ways to finish an assignment from a used-receiver mask.
+
+    Givers are assigned in index order, so the number of set bits in the mask
+    tells which giver is next. This is the permanent of the 0/1 allowed matrix
+    computed by dynamic programming over subsets, O(2^n * n).
+    """
+    allowed = []
+    for gi in range(n):
+        if pinned[gi] is not None:
+            allowed.append([pinned[gi]])
+        else:
+            allowed.append([ri for ri in range(n) if ri not in forbidden[gi]])
+
+    @functools.lru_cache(maxsize=None)
+    def ways(mask):
+        gi = bin(mask).count("1")
+        if gi == n:
+            return 1
+        return sum(ways(mask | (1 << ri)) for ri in allowed[gi] if not mask & (1 << ri))
+
+    return allowed, ways
+
+
+def count_assignments(participants, restrictions, mandates):
+    """Count valid assignments exactly. Exponential in the group size."""
+    constraints = build_constraints(participants, restrictions, mandates)
+    if constraints is None or len(participants) < 2:
+        return 0
+    _, ways = _completion_counter(len(participants), *constraints)
+    return ways(0)
+
+
+def _sample_exact(participants, pinned, forbidden, rng):
+    """Draw an assignment uniformly by sequential sampling weighted by completion counts."""
+    n = len(participants)
+    allowed, ways = _completion_counter(n, pinned, forbidden)
+    if ways(0) == 0:
+        return None
+    mask = 0
+    result = []
+    for gi in range(n):
+        options = [ri for ri in allowed[gi] if not mask & (1 << ri)]
+        weights = [ways(mask | (1 << ri)) for ri in options]
+        ri = rng.choices(options, weights=weights)[0]
+        mask |= 1 << ri
+        result.append(participants[ri])
+    return tuple(result)
+
+
+def _sample_mcmc(participants, pinned, forbidden, start, steps, rng):
+    """Run a swap chain from a valid assignment and return where it ends up.
+
+    Each step proposes one move on the free givers and keeps it only if it
+    stays valid: swapping the receivers of two givers, rotating the receivers
+    of three, or rotating along an alternating cycle. The cycle move is a
+    random walk from a random giver that repeatedly steps to the current
+    owner of a receiver drawn uniformly from those the walker may take, and
+    closes when it gets back to the start (walks that cross themselves are
+    dropped). Its probability only depends on which givers are on the cycle,
+    and undoing it is a cycle through the same givers, so every move is
+    symmetric and the chain is uniform over the valid assignments. Any two
+    valid assignments differ by such cycles, so with tight rules (e.g. everyone
+    may only give to the next two people in a ring) the chain still reaches
+    all of them, where swaps and rotations alone get stuck.
+    """
+    index = {name: i for i, name in enumerate(participants)}
+    receiver_of = [index[name] for name in start]
+    owner = [None] * len(participants)
+    for gi, ri in enumerate(receiver_of):
+        owner[ri] = gi
+    free = [gi for gi in range(len(participants)) if pinned[gi] is None]
+    if len(free) < 2:
+        return tuple(start)
+    # Mandated receivers are forbidden for everyone else, so free givers only ever trade these
+    free_receivers = [receiver_of[gi] for gi in free]
+    allowed_cache = {}
+
+    def other_allowed(giver):
+        """A receiver drawn uniformly from those `giver` may take instead of their own, or None"""
+        own = receiver_of[giver]
+        allowed = allowed_cache.get(giver)
+        if allowed is None:
+            for _ in range(16):
+                ri = rng.choice(free_receivers)
+                if ri != own and ri not in forbidden[giver]:
+                    return ri
+            # Heavily restricted giver: draw from their short list from now on
+            allowed = allowed_cache[giver] = [ri for ri in free_receivers if ri not in forbidden[giver]]
+        if len(allowed) < 2:
+            return None
+        while True:
+            ri = rng.choice(allowed)
+            if ri != own:
+                return ri
+
+    for _ in range(steps):
+        move = rng.random()
+        if move < CYCLE_MOVE_SHARE:
+            first = giver = rng.choice(free)
+            cycle = [first]
+            on_cycle = {first}
+            while True:
+                ri = other_allowed(giver)
+                if ri is None:
+                    break
+                giver = owner[ri]
+                if giver == first or giver in on_cycle:
+                    break
+                cycle.append(giver)
+                on_cycle.add(giver)
+            if ri is not None and giver == first:
+                # Everyone on the cycle takes the receiver of the next one
+                taken = [receiver_of[gi] for gi in cycle[1:]] + [receiver_of[first]]
+                for gi, ri in zip(cycle, taken):
+                    receiver_of[gi] = ri
+                    owner[ri] = gi
+        elif len(free) >= 3 and move < (1 + CYCLE_MOVE_SHARE) / 2:
+            a, b, c = rng.sample(free, 3)
+            ra, rb, rc = receiver_of[a], receiver_of[b], receiver_of[c]
+            # a takes b's receiver, b takes c's, c takes a's
+            if rb not in forbidden[a] and rc not in forbidden[b] and ra not in forbidden[c]:
+                receiver_of[a], receiver_of[b], receiver_of[c] = rb, rc, ra
+                owner[rb], owner[rc], owner[ra] = a, b, c
+        else:
+            a, b = rng.sample(free, 2)
+            ra, rb = receiver_of[a], receiver_of[b]
+            if rb not in forbidden[a] and ra not in forbidden[b]:
+                receiver_of[a], receiver_of[b] = rb, ra
+                owner[rb], owner[ra] = a, b
+
+    return tuple(participants[ri] for ri in receiver_of)
+
+
+def sample_assignment(participants, restrictions, mandates, method="auto", start=None,
+                      mixing_steps=None, exact_limit=EXACT_SAMPLING_LIMIT, rng=None):
+    """Draw a uniformly random valid assignment without listing all of them.
+
+    method is "exact" (counting DP, only for small groups), "mcmc" (swap chain
+    with `mixing_steps` moves, default MIXING_STEPS_PER_PERSON per participant)
+    or "auto", which picks exact up to `exact_limit` participants. `start` may
+    be a previous valid assignment to continue the chain from, so a reshuffle
+    only costs the mixing budget. Returns None if no valid assignment exists.
+    """
+    rng = rng or random
+    n = len(participants)
+    if n < 2:
+        return None
+    constraints = build_constraints(participants, restrictions, mandates)
+    if constraints is None:
+        return None
+    pinned, forbidden = constraints
+
+    if method == "auto":
+        method = "exact" if n <= exact_limit else "mcmc"
+
+    if method == "exact":
+        return _sample_exact(participants, pinned, forbidden, rng)
+
+    if method == "mcmc":
+        if start is None or not is_valid_assignment(participants, start, restrictions, mandates):
+            start = find_assignment(participants, restrictions, mandates, rng=rng)
+            if start is None:
+                return None
+        if mixing_steps is None:
+            mixing_steps = MIXING_STEPS_PER_PERSON * n
+        return _sample_mcmc(participants, pinned, forbidden, start, mixing_steps, rng)
+
+    raise ValueError(f"Unknown sampling method: {method}")
+
+
+
+class RuleChecker:
+    """Keeps one valid assignment up to date while the setup is being edited.
+
+    Participants and rules live in a ParticipantRegistry; the checker only
+    keeps the giver -> receiver matching. Every rule change goes through the
+    checker, which repairs the matching with a single augmenting-path search
+    from the giver it displaced and only writes the rule to the registry if
+    that succeeds, so a rule that makes the setup impossible is rejected right
+    away. The explanation names the group of givers that has too few
+    receivers left between them (a Hall violator) rather than leaving it to a
+    search at game time.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.label = registry.name_of
+        self.match = {}
+        self.owner = {}
+        # Seed with a full assignment in one pass instead of augmenting giver by giver
+        participants = list(registry.names)
+        seed = None
+        if len(participants) >= 2:
+            seed = find_assignment(participants, registry.restrictions, registry.mandates)
+        if seed is not None:
+            for giver, receiver in zip(participants, seed):
+                self._link(giver, receiver)
+        else:
+            self._repair()
+
+    def allowed(self, giver, receiver):
+        registry = self.registry
+        if giver == receiver or receiver not in registry.names or registry.is_restricted(giver, receiver):
+            return False
+        if giver in registry.mandates:
+            return registry.mandates[giver] == receiver
+        return receiver not in registry.mandated_by
+
+    @property
+    def feasible(self):
+        return len(self.registry) >= 2 and len(self.match) == len(self.registry)
+
+    def _link(self, giver, receiver):
+        self.match[giver] = receiver
+        self.owner[receiver] = giver
+
+    def _unmatch(self, giver):
+        receiver = self.match.pop(giver, None)
+        if receiver is not None:
+            del self.owner[receiver]
+        return receiver
+
+    def _augment(self, start):
+        """Match `start` through an augmenting path.
+
+        Returns None on success. On failure the matching is untouched and the
+        (givers, receivers) explored are returned: those givers can only
+        reach those receivers, and there is one receiver too few.
+        """
+        mandates = self.registry.mandates
+        unvisited = set(self.registry.names)
+        parent = {}
+        givers = [start]
+        queue = [start]
+        while queue:
+            next_queue = []
+            for giver in queue:
+                if giver in mandates:
+                    candidates = [mandates[giver]] if mandates[giver] in unvisited else []
+                else:
+                    candidates = [r for r in unvisited if self.allowed(giver, r)]
+                for receiver in candidates:
+                    unvisited.discard(receiver)
+                    parent[receiver] = giver
+                    owner = self.owner.get(receiver)
+                    if owner is None:
+                        while receiver is not None:
+                            giver = parent[receiver]
+                            previous = self.match.get(giver)
+                            self._link(giver, receiver)
+                            receiver = previous
+                        return None
+                    givers.append(owner)
+                    next_queue.append(owner)
+            queue = next_queue
+        return givers, list(parent)
+
+    def _repair(self):
+        """Drop matches that are no longer allowed and re-augment every unmatched giver"""
+        for giver, receiver in list(self.match.items()):
+            if giver not in self.registry.names or not self.allowed(giver, receiver):
+                self._unmatch(giver)
+        for giver in self.registry.names:
+            if giver not in self.match:
+                violator = self._augment(giver)
+                if violator is not None:
+                    return violator
+        return None
+
+    def explain(self, violator):
+        givers = [self.label(giver) for giver in violator[0]]
+        receivers = sorted(self.label(receiver) for receiver in violator[1])
+        if not receivers:
+            return f"{givers[0]} would have nobody left they are allowed to gift to."
+        return (
+            f"{', '.join(givers)} could only gift to {', '.join(receivers)} between them, "
+            f"so one of them would be left without a recipient."
+        )
+
+    def conflict(self):
+        """Explain why the current setup has no valid assignment, or None if it has one"""
+        if len(self.registry) < 2:
+            return "At least two participants are needed."
+        violator = self._repair()
+        return None if violator is None else self.explain(violator)
+
+    def add_restriction(self, giver, receiver):
+        """Forbid giver -> receiver. Returns (ok, explanation)"""
+        registry = self.registry
+        if registry.mandates.get(giver) == receiver:
+            return False, f"{self.label(giver)} must gift to {self.label(receiver)}."
+        if not self.feasible:
+            conflict = self.conflict()
+            if conflict:
+                return False, conflict
+        registry.add_restriction(giver, receiver)
+        if self.match.get(giver) != receiver:
+            return True, None
+
+        # The only pair this breaks is the one giver currently has
+        self._unmatch(giver)
+        violator = self._augment(giver)
+        if violator is None:
+            return True, None
+        registry.remove_restriction(giver, receiver)
+        self._link(giver, receiver)
+        return False, self.explain(violator)
+
+    def add_mandate(self, giver, receiver):
+        """Require giver -> receiver, replacing any earlier mandate of giver. Returns (ok, explanation)"""
+        registry = self.registry
+        if giver == receiver:
+            return False, f"{self.label(giver)} can't gift to themselves."
+        if registry.is_restricted(giver, receiver):
+            return False, f"{self.label(giver)} can't gift to {self.label(receiver)}."
+        other = registry.mandated_by.get(receiver)
+        if other is not None and other != giver:
+            return False, f"{self.label(other)} must already gift to {self.label(receiver)}."
+        if not self.feasible:
+            conflict = self.conflict()
+            if conflict:
+                return False, conflict
+
+        previous = registry.mandates.get(giver)
+        registry.set_mandate(giver, receiver)
+        if self.match.get(giver) == receiver:
+            return True, None
+
+        # giver takes receiver over from its current owner, who then has to find someone else
+        displaced = self.owner[receiver]
+        old_receiver = self._unmatch(giver)
+        self._unmatch(displaced)
+        self._link(giver, receiver)
+        violator = self._augment(displaced)
+        if violator is None:
+            return True, None
+
+        self._unmatch(giver)
+        self._link(giver, old_receiver)
+        self._link(displaced, receiver)
+        if previous is None:
+            registry.remove_mandate(giver)
+        else:
+            registry.set_mandate(giver, previous)
+        return False, self.explain(violator)
+
+    def remove_restriction(self, giver, receiver):
+        self.registry.remove_restriction(giver, receiver)
+        if not self.feasible:
+            self._repair()
+
+    def remove_mandate(self, giver):
+        self.registry.remove_mandate(giver)
+        if not self.feasible:
+            self._repair()
+
+    def add_participant(self, pid):
+        """Match someone just added to the registry"""
+        if pid in self.match or len(self.registry) < 2:
+            return
+        if len(self.match) < len(self.registry) - 1:
+            # Someone else is unmatched already: the setup needs a full repair anyway
+            self._repair()
+            return
+        # Splice the newcomer into an existing pair: giver -> pid -> giver's old receiver.
+        # Trying the latest arrivals almost always succeeds, otherwise fall back to a full search.
+        for giver in itertools.islice(reversed(self.registry.names), 1, 9):
+            receiver = self.match[giver]
+            if self.allowed(giver, pid) and self.allowed(pid, receiver):
+                self._unmatch(giver)
+                self._link(giver, pid)
+                self._link(pid, receiver)
+                return
+        self._repair()
+
+    def remove_participant(self, pid):
+        """Fix the matching after someone (and every rule mentioning them) left the registry"""
+        # Whoever gave to pid takes over pid's receiver if they may, otherwise searches
+        freed = self._unmatch(pid)
+        giver = self.owner.get(pid)
+        if giver is None:
+            return
+        self._unmatch(giver)
+        if freed is not None and self.allowed(giver, freed):
+            self._link(giver, freed)
+        elif self._augment(giver) is not None:
+            self._repair()
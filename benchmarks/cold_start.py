@@ -0,0 +1,72 @@
+"""Cold start of the setup page: module import time and time to first render, in fresh interpreters.
+
+Also checks that nothing on the way to the setup page imports dlib,
+face_recognition or OpenCV; those are loaded later, in the background or on
+first use. Run from the repository root:
+
+    python benchmarks/cold_start.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules secret_gift.py imports before the setup page renders
+APP_MODULES = (
+    "exchange", "gallery", "face_store", "encoding_service", "frame_cache", "history", "metrics", "onboarding", "vision"
+)
+HEAVY_MODULES = ("dlib", "face_recognition", "cv2")
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+RENDER_PROBE = """
+import json, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("secret_gift.py", default_timeout=120).run()
+print(json.dumps({"seconds": time.perf_counter() - started, "errors": [str(e.value) for e in app.exception]}))
+"""
+
+
+def probe(code):
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--skip-render", action="store_true", help="only time the imports")
+    args = parser.parse_args()
+
+    imports = [probe(IMPORT_PROBE.format(modules=APP_MODULES, heavy=HEAVY_MODULES)) for _ in range(args.runs)]
+    heavy = sorted({module for run in imports for module in run["heavy"]})
+    print(f"imports          median {statistics.median(r['seconds'] for r in imports):.3f}s over {args.runs} runs")
+    if heavy:
+        print(f"FAIL heavy modules imported before the setup page: {', '.join(heavy)}")
+
+    if not args.skip_render:
+        renders = [probe(RENDER_PROBE) for _ in range(args.runs)]
+        print(f"setup first run  median {statistics.median(r['seconds'] for r in renders):.3f}s over {args.runs} runs")
+        for error in {error for run in renders for error in run["errors"]}:
+            print(f"FAIL setup page raised: {error}")
+            heavy.append(error)
+
+    sys.exit(1 if heavy else 0)
+
+
+if __name__ == "__main__":
+    main()
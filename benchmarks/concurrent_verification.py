@@ -0,0 +1,75 @@
+"""Simulate N kiosks verifying at once, inline versus through the encoding worker pool.
+
+Inline runs every frame on threads of a single interpreter, the way Streamlit
+script runs share one process today. The pool run hands the same frames to
+EncodingService. Run from the repository root:
+
+    python benchmarks/concurrent_verification.py --image me.jpg --concurrency 8
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vision
+from encoding_service import EncodingService
+
+
+def load_frame(path):
+    """Frame bytes to verify; a noise frame still exercises the full detector when no photo is given"""
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    noise = np.random.default_rng(0).integers(0, 255, size=(480, 640, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(noise).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def run(label, encode, frame, concurrency, rounds):
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        started = time.perf_counter()
+        list(threads.map(lambda _: encode(frame), range(concurrency * rounds)))
+        elapsed = time.perf_counter() - started
+    total = concurrency * rounds
+    print(f"{label:<8} {total} verifications in {elapsed:6.2f}s  ->  {total / elapsed:6.2f}/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", help="photo with a face (defaults to a noise frame)")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--jitters", type=int, default=3)
+    args = parser.parse_args()
+
+    frame = load_frame(args.image)
+    inline = run(
+        "inline",
+        lambda data: vision.encode_frame(io.BytesIO(data), num_jitters=args.jitters),
+        frame, args.concurrency, args.rounds,
+    )
+
+    service = EncodingService(max_workers=args.concurrency, max_queue=args.concurrency * args.rounds)
+    # Let every worker load its models before timing
+    for future in [service.submit(frame) for _ in range(args.concurrency)]:
+        future.result()
+    pooled = run(
+        "pool",
+        lambda data: service.encode(data, num_jitters=args.jitters),
+        frame, args.concurrency, args.rounds,
+    )
+    service.shutdown()
+    print(f"speed-up {inline / pooled:.2f}x with {args.concurrency} workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Reproducible benchmarks for the assignment, history, identification and face store hot paths.
+
+Everything runs on synthetic data from a fixed seed, without Streamlit or a
+camera. Results are written as JSON; pass --baseline with an earlier results
+file to fail when any case got slower than --max-regression times. Run from
+the repository root:
+
+    python benchmarks/run_benchmarks.py --output bench_results.json
+    python benchmarks/run_benchmarks.py --baseline bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assignment import RuleChecker, find_assignment, sample_assignment
+from registry import ParticipantRegistry
+
+SUITES = ("assignment", "history", "identification", "store")
+
+
+def timed(function, repeat):
+    """Median wall time of `repeat` calls, in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def synthetic_rules(n, density, rng):
+    """Participants plus restrictions covering `density` of each giver's possible receivers, and a few mandates"""
+    participants = [f"person_{i}" for i in range(n)]
+    per_giver = int(density * (n - 1))
+    restrictions = {}
+    if per_giver:
+        for giver in participants:
+            restrictions[giver] = rng.sample([p for p in participants if p != giver], per_giver)
+    mandates = {}
+    # A ring of mandates through a handful of people is always satisfiable with any restrictions lifted
+    ring = participants[: min(4, n // 4)]
+    for giver, receiver in zip(ring, ring[1:] + ring[:1]):
+        if len(ring) > 1:
+            mandates[giver] = receiver
+            if receiver in restrictions.get(giver, []):
+                restrictions[giver].remove(receiver)
+    return participants, restrictions, mandates
+
+
+def rule_registry(participants, restrictions, mandates):
+    """A registry holding these rules as they are, without the checks GiftExchange runs on each one"""
+    registry = ParticipantRegistry()
+    ids = {name: registry.add(name) for name in participants}
+    for giver, restricted in restrictions.items():
+        for receiver in restricted:
+            registry.add_restriction(ids[giver], ids[receiver])
+    for giver, receiver in mandates.items():
+        registry.set_mandate(ids[giver], ids[receiver])
+    return registry
+
+
+def bench_assignment(sizes, densities, repeat, rng):
+    results = []
+    for n in sizes:
+        for density in densities:
+            participants, restrictions, mandates = synthetic_rules(n, density, rng)
+            start = find_assignment(participants, restrictions, mandates, rng=rng)
+            registry = rule_registry(participants, restrictions, mandates)
+            results.append({
+                "suite": "assignment",
+                "case": f"n={n} density={density}",
+                "participants": n,
+                "density": density,
+                "feasible": start is not None,
+                "find_ms": timed(lambda: find_assignment(participants, restrictions, mandates, rng=rng), repeat),
+                "sample_ms": timed(
+                    lambda: sample_assignment(participants, restrictions, mandates, start=start, rng=rng), repeat
+                ),
+                "checker_build_ms": timed(lambda: RuleChecker(registry), 1),
+            })
+    return results
+
+
+def bench_history(sizes, density, years, repeat, rng):
+    from history import history_assignment
+
+    results = []
+    for n in sizes:
+        participants, restrictions, mandates = synthetic_rules(n, density, rng)
+        history = []
+        for _ in range(years):
+            past = find_assignment(participants, restrictions, mandates, rng=rng)
+            history.insert(0, dict(zip(participants, past)))
+        results.append({
+            "suite": "history",
+            "case": f"n={n} years={years}",
+            "participants": n,
+            "years": years,
+            "solve_ms": timed(lambda: history_assignment(participants, restrictions, mandates, history, rng=rng), repeat),
+        })
+    return results
+
+
+def synthetic_encodings(count, seed):
+    import numpy as np
+
+    # Real encodings sit on a shell of radius ~1; spread enough that nearest neighbours are meaningful
+    encodings = np.random.default_rng(seed).normal(0, 0.09, size=(count, 128)).astype(np.float32)
+    return [f"person_{i}" for i in range(count)], encodings
+
+
+def bench_identification(sizes, repeat, seed):
+    from gallery import FaceGallery
+
+    results = []
+    for size in sizes:
+        names, encodings = synthetic_encodings(size, seed)
+        gallery = FaceGallery.from_matrix(names, encodings)
+        probe = encodings[size // 2] + 0.01
+        results.append({
+            "suite": "identification",
+            "case": f"gallery={size}",
+            "gallery_size": size,
+            "identify_ms": timed(lambda: gallery.identify(probe), repeat),
+        })
+    return results
+
+
+def bench_store(sizes, seed):
+    from face_store import FaceStore
+
+    results = []
+    for size in sizes:
+        names, encodings = synthetic_encodings(size + 1, seed)
+        with tempfile.TemporaryDirectory() as directory:
+            store = FaceStore(os.path.join(directory, "face_data"))
+            started = time.perf_counter()
+            for name, encoding in zip(names[:size], encodings[:size]):
+                store.append(name, encoding)
+            fill_ms = (time.perf_counter() - started) * 1000
+            results.append({
+                "suite": "store",
+                "case": f"store={size}",
+                "store_size": size,
+                "append_ms": timed(lambda: store.append(names[size], encodings[size]), 1),
+                "append_avg_ms": fill_ms / size,
+                "load_ms": timed(lambda: FaceStore(store.base_path).load(), 5),
+                "cached_load_ms": timed(store.gallery, 5),
+            })
+    return results
+
+
+def compare(results, baseline_path, max_regression):
+    """Return a list of (case, metric, old, new) that regressed beyond `max_regression`"""
+    with open(baseline_path, "r") as f:
+        baseline = {(r["suite"], r["case"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        old = baseline.get((result["suite"], result["case"]))
+        if old is None:
+            continue
+        for metric, value in result.items():
+            # Ignore sub-millisecond noise
+            if metric.endswith("_ms") and metric in old and value > max(old[metric] * max_regression, 1.0):
+                regressions.append((result["case"], metric, old[metric], value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", choices=SUITES, action="append", help="run only these suites")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.0, 0.05, 0.5])
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument("--history-years", type=int, default=5)
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--store-sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=1.25)
+    args = parser.parse_args()
+
+    suites = args.suite or SUITES
+    rng = random.Random(args.seed)
+    results = []
+    if "assignment" in suites:
+        results += bench_assignment(args.sizes, args.densities, args.repeat, rng)
+    if "history" in suites:
+        results += bench_history(args.history_sizes, 0.05, args.history_years, args.repeat, rng)
+    if "identification" in suites:
+        results += bench_identification(args.gallery_sizes, args.repeat, args.seed)
+    if "store" in suites:
+        results += bench_store(args.store_sizes, args.seed)
+
+    for result in results:
+        metrics = ", ".join(f"{k}={v:.3f}" for k, v in result.items() if k.endswith("_ms"))
+        print(f"{result['suite']:<15} {result['case']:<24} {metrics}")
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.max_regression)
+        for case, metric, old, new in regressions:
+            print(f"REGRESSION {case} {metric}: {old:.3f} ms -> {new:.3f} ms")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
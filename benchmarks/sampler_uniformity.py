@@ -0,0 +1,93 @@
+"""Check that the assignment samplers are uniform against brute-force enumeration.
+
+For a handful of small rule sets every valid assignment is enumerated, a few
+thousand draws are taken from each sampler, and a chi-square statistic is
+compared against the 0.999 quantile. Run from the repository root:
+
+    python benchmarks/sampler_uniformity.py --draws 20000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assignment import count_assignments, enumerate_assignments, sample_assignment
+
+
+def ring(n, reach):
+    """Everyone may only give to the next `reach` people around a circle.
+
+    Swaps and three-way rotations cannot move between these assignments, so
+    these cases check that the swap chain still reaches all of them.
+    """
+    people = [f"P{i}" for i in range(n)]
+    allowed = {person: {people[(i + step) % n] for step in range(1, reach + 1)} for i, person in enumerate(people)}
+    return people, {person: [other for other in people if other not in allowed[person]] for person in people}, {}
+
+
+CASES = {
+    "derangements of 3": (["A", "B", "C"], {}, {}),
+    "derangements of 5": (["A", "B", "C", "D", "E"], {}, {}),
+    "restrictions": (
+        ["A", "B", "C", "D", "E", "F"],
+        {"A": ["B", "C"], "D": ["E"], "F": ["A"]},
+        {},
+    ),
+    "restrictions and mandate": (
+        ["A", "B", "C", "D", "E", "F"],
+        {"B": ["C"], "E": ["F", "A"]},
+        {"A": "D"},
+    ),
+    "ring of 7, next two only": ring(7, 2),
+    "ring of 8, next three only": ring(8, 3),
+}
+
+
+def chi_square_critical(df, z=3.090):
+    """Wilson-Hilferty approximation of the chi-square quantile (z=3.090 is p=0.999)."""
+    return df * (1 - 2 / (9 * df) + z * math.sqrt(2 / (9 * df))) ** 3
+
+
+def check(name, participants, restrictions, mandates, method, draws, rng):
+    support = list(enumerate_assignments(participants, restrictions, mandates))
+    assert len(support) == count_assignments(participants, restrictions, mandates), name
+
+    counts = Counter()
+    previous = None
+    for _ in range(draws):
+        drawn = sample_assignment(participants, restrictions, mandates, method=method, start=previous, rng=rng)
+        counts[drawn] += 1
+        previous = drawn
+
+    unexpected = set(counts) - set(support)
+    expected = draws / len(support)
+    statistic = sum((counts[c] - expected) ** 2 / expected for c in support)
+    df = len(support) - 1
+    critical = chi_square_critical(df) if df else 0.0
+    ok = not unexpected and statistic <= critical
+    print(f"{'PASS' if ok else 'FAIL'}  {name:<26} {method:<6} support={len(support):<4} "
+          f"chi2={statistic:8.2f} critical={critical:8.2f}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--draws", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = [
+        check(name, *case, method=method, draws=args.draws, rng=rng)
+        for name, case in CASES.items()
+        for method in ("exact", "mcmc")
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
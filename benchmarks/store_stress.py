@@ -0,0 +1,130 @@
+"""Stress the shared face store with many enrolling processes and concurrent readers.
+
+Each enroller process registers its own names (and re-registers some of
+them) against one store directory while reader processes keep taking
+snapshots. Readers check that every snapshot is consistent: each encoding
+matches its name and a name never disappears once seen. At the end every
+registration must be present. Run from the repository root:
+
+    python benchmarks/store_stress.py --enrollers 16 --faces 200 --readers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+
+def expected(worker, face):
+    """Encoding for a name, recognizable from any single element"""
+    return np.full(128, worker * 100000 + face, dtype=np.float32)
+
+
+def check(gallery, seen):
+    """Return the problems with one snapshot and record the names in it"""
+    problems = []
+    names = set(gallery.names)
+    for name in names:
+        worker, face = (int(part) for part in name[1:].split("_"))
+        if not np.array_equal(np.asarray(gallery.get(name), dtype=np.float32), expected(worker, face)):
+            problems.append(f"{name} has the wrong encoding")
+    missing = seen - names
+    if missing:
+        problems.append(f"{len(missing)} names disappeared, e.g. {sorted(missing)[0]}")
+    seen |= names
+    return problems
+
+
+def enroll(base_path, worker, faces, compact_every, reregister_every):
+    import face_store
+
+    face_store.COMPACT_WAL_RECORDS = compact_every
+    store = face_store.FaceStore(base_path)
+    for face in range(faces):
+        store.append(f"w{worker}_{face}", expected(worker, face))
+        if reregister_every and face % reregister_every == 0:
+            # Re-registration orphans a row, which eventually triggers a dead-row compaction
+            store.append(f"w{worker}_{face}", expected(worker, face))
+
+
+def read(base_path, stop, results):
+    from face_store import FaceStore
+
+    shared = FaceStore(base_path)
+    seen_shared, seen_fresh = set(), set()
+    snapshots, problems = 0, []
+    while not stop.is_set():
+        try:
+            problems += check(shared.gallery(), seen_shared)
+            problems += check(FaceStore(base_path).load(), seen_fresh)
+        except Exception as e:
+            # e.g. a half-written file: exactly what the store must never expose
+            problems.append(f"snapshot failed: {e!r}")
+        snapshots += 2
+    results.put((snapshots, problems[:10]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--enrollers", type=int, default=16)
+    parser.add_argument("--faces", type=int, default=200, help="registrations per enroller")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--compact-every", type=int, default=200, help="log records between checkpoints")
+    parser.add_argument("--reregister-every", type=int, default=10)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        base_path = os.path.join(directory, "face_data")
+        stop, results = context.Event(), context.Queue()
+        readers = [context.Process(target=read, args=(base_path, stop, results)) for _ in range(args.readers)]
+        enrollers = [
+            context.Process(target=enroll, args=(base_path, worker, args.faces, args.compact_every, args.reregister_every))
+            for worker in range(args.enrollers)
+        ]
+        for process in readers:
+            process.start()
+        started = time.perf_counter()
+        for process in enrollers:
+            process.start()
+        for process in enrollers:
+            process.join()
+        seconds = time.perf_counter() - started
+        stop.set()
+        reader_results = [results.get() for _ in readers]
+        for process in readers:
+            process.join()
+
+        from face_store import FaceStore
+
+        final = FaceStore(base_path).load()
+        problems = check(final, set())
+        expected_names = {f"w{worker}_{face}" for worker in range(args.enrollers) for face in range(args.faces)}
+        lost = expected_names - set(final.names)
+        if lost:
+            problems.append(f"{len(lost)} registrations lost, e.g. {sorted(lost)[0]}")
+        problems += [problem for _, reader_problems in reader_results for problem in reader_problems]
+        failed = [process.exitcode for process in enrollers + readers if process.exitcode]
+        if failed:
+            problems.append(f"{len(failed)} processes crashed")
+
+        reregistrations = len(range(0, args.faces, args.reregister_every)) if args.reregister_every else 0
+        writes = args.enrollers * (args.faces + reregistrations)
+        generation = FaceStore(base_path)._read_index()["generation"]
+        print(
+            f"{args.enrollers} enrollers wrote {writes} registrations in {seconds:.2f}s ({writes / seconds:.0f}/s), "
+            f"{len(final)} faces, {generation} compactions, "
+            f"{sum(snapshots for snapshots, _ in reader_results)} reader snapshots"
+        )
+        for problem in problems:
+            print(f"FAIL {problem}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Compare snapshot-style verification with keyframe detection plus tracking on a recorded clip.
+
+The person in the clip is registered from --photo, or else from the last
+--register-frames frames of the clip, which are then left out of
+verification (registering from the very frames being verified would match
+on the first try). Then the clip is verified twice from its first frame:
+once detecting and encoding every frame until a confident match (what
+repeated snapshot retakes cost), and once with streaming.verify_stream.
+Run from the repository root:
+
+    python benchmarks/stream_verification.py --clip recording.mp4 --photo me.jpg
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+from PIL import Image
+
+from gallery import DEFAULT_TOLERANCE, FaceGallery
+from streaming import CONFIDENT_MARGIN, KEYFRAME_INTERVAL, iter_video, verify_stream
+from vision import aggregate_template, crop_to_face, detect_faces, encode_adaptive, encode_frame, largest_face
+
+
+def clip_length(path):
+    capture = cv2.VideoCapture(path)
+    try:
+        return int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+
+
+def register(args):
+    """Gallery holding the person in the clip, as the registration tab would store them.
+
+    Returns (gallery, frames); only the first `frames` frames of the clip
+    may be used for verification.
+    """
+    if args.photo:
+        encoding, _ = encode_frame(args.photo, num_jitters=3, adaptive=False)
+        frames = args.max_frames
+    else:
+        total = clip_length(args.clip)
+        frames = min(args.max_frames, total - args.register_frames)
+        if frames <= 0:
+            sys.exit(f"The clip has {total} frames, too few to register from its last {args.register_frames}; "
+                     f"pass --photo or a longer clip")
+        encodings = []
+        for rgb in itertools.islice(iter_video(args.clip, total), total - args.register_frames, None):
+            boxes = detect_faces(Image.fromarray(rgb))
+            if boxes:
+                crop, box = crop_to_face(rgb, largest_face(boxes))
+                encodings.append(encode_adaptive(crop, box, 3)[0])
+        encoding = aggregate_template(encodings)[0] if encodings else None
+    if encoding is None:
+        sys.exit("No face found to register")
+    gallery = FaceGallery()
+    gallery.add("person", encoding)
+    return gallery, frames
+
+
+def verify_every_frame(frames, gallery, tolerance):
+    """Full detection and encoding on each frame, like a new snapshot per try"""
+    started = time.perf_counter()
+    report = {"frames": 0, "detections": 0, "tracked": 0, "encodings": 0, "confident": False}
+    best = (None, float("inf"))
+    for rgb in frames:
+        report["frames"] += 1
+        report["detections"] += 1
+        boxes = detect_faces(Image.fromarray(rgb))
+        if not boxes:
+            continue
+        crop, box = crop_to_face(rgb, largest_face(boxes))
+        encoding, _ = encode_adaptive(crop, box, 3, gallery, tolerance)
+        report["encodings"] += 1
+        name, distance = gallery.identify(encoding, tolerance)
+        best = min(best, (name, distance), key=lambda match: match[1])
+        if name is not None and distance <= tolerance - CONFIDENT_MARGIN:
+            report["confident"] = True
+            break
+    report["seconds"] = time.perf_counter() - started
+    return best[0], best[1], report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clip", required=True, help="recorded video of a registered person")
+    parser.add_argument("--photo", help="registration photo; defaults to the end of the clip")
+    parser.add_argument("--register-frames", type=int, default=30,
+                        help="without --photo, register from this many frames at the end of the clip")
+    parser.add_argument("--keyframe-interval", type=int, default=KEYFRAME_INTERVAL)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--max-frames", type=int, default=300)
+    args = parser.parse_args()
+
+    gallery, frames = register(args)
+    runs = {
+        "every frame": verify_every_frame(iter_video(args.clip, frames), gallery, args.tolerance),
+        "streaming": verify_stream(
+            iter_video(args.clip, frames), gallery, args.tolerance, keyframe_interval=args.keyframe_interval
+        ),
+    }
+    for label, (name, distance, report) in runs.items():
+        print(
+            f"{label:<12} match={name} distance={distance:.3f} confident={report['confident']} "
+            f"frames={report['frames']} detections={report['detections']} tracked={report['tracked']} "
+            f"encodings={report['encodings']} seconds={report['seconds']:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
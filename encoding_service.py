@@ -0,0 +1,216 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from gallery import FaceGallery
+
+# One worker per core by default; dlib holds the GIL so threads would not help
+DEFAULT_WORKERS = os.cpu_count() or 2
+# Jobs allowed to wait for a free worker before new requests are turned away
+DEFAULT_MAX_QUEUE = 8
+# Seconds a caller waits for its encoding before giving up
+DEFAULT_TIMEOUT = 30.0
+# Seconds a caller waits for a whole upload batch or video clip
+DEFAULT_CLIP_TIMEOUT = 120.0
+
+logger = logging.getLogger(__name__)
+
+
+class EncodingServiceBusy(RuntimeError):
+    """Raised when the worker pool and its queue are both full"""
+
+
+def _init_worker():
+    """Load dlib and the face models once per worker process instead of once per job"""
+    import vision
+    seconds = vision.warm_up()
+    logger.info(f"Encoding worker {os.getpid()} ready after {seconds:.2f}s")
+
+
+def _ping():
+    return os.getpid()
+
+
+def _gallery(names, matrix):
+    return FaceGallery.from_matrix(names, matrix) if names is not None else None
+
+
+def _gallery_args(gallery):
+    """(names, matrix) to rebuild `gallery` in a worker; only the filled rows are sent"""
+    if gallery is None:
+        return None, None
+    names = list(gallery.names)
+    return names, np.ascontiguousarray(gallery.matrix[:len(names)])
+
+
+def _detection_args(scale, model):
+    """Detection settings for a job, falling back to the vision defaults"""
+    import vision
+    return (
+        vision.DEFAULT_DETECTION_SCALE if scale is None else scale,
+        vision.DEFAULT_DETECTION_MODEL if model is None else model,
+    )
+
+
+def _encode_args(frame, num_jitters, scale, model, gallery, tolerance):
+    return (frame, num_jitters, *_detection_args(scale, model), *_gallery_args(gallery), tolerance)
+
+
+def _upload(name, data):
+    """In-memory stand-in for an uploaded file: the vision helpers only use .name and .getvalue()"""
+    upload = io.BytesIO(data)
+    upload.name = name
+    return upload
+
+
+def _encode_job(frame, num_jitters, scale, model, names, matrix, tolerance):
+    import vision
+    return vision.encode_frame(
+        io.BytesIO(frame),
+        num_jitters=num_jitters,
+        scale=scale,
+        model=model,
+        gallery=_gallery(names, matrix),
+        tolerance=tolerance,
+    )
+
+
+def _enroll_job(uploads, num_jitters, scale, model):
+    import vision
+    images = []
+    for name, data in uploads:
+        if name.rsplit(".", 1)[-1].lower() in vision.VIDEO_TYPES:
+            images.extend(vision.video_frames(_upload(name, data)))
+        else:
+            images.append(vision.load_rgb(io.BytesIO(data)))
+    return vision.encode_batch(images, num_jitters=num_jitters, scale=scale, model=model)
+
+
+def _stream_job(source, names, matrix, tolerance, scale, model):
+    from streaming import iter_video, verify_stream  # loads OpenCV, only needed for clips
+    if isinstance(source, tuple):
+        source = _upload(*source)
+    return verify_stream(iter_video(source), _gallery(names, matrix), tolerance, scale=scale, model=model)
+
+
+class EncodingService:
+    """Runs face detection and encoding on a bounded pool of worker processes.
+
+    The Streamlit script thread only hands over the frame bytes and waits, so
+    several kiosks verifying at once are spread over all cores instead of
+    queueing behind each other on one interpreter. If a worker dies (e.g. it
+    is killed for memory) the pool is replaced and the job retried once.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.executor = self._start_pool()
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            # spawn: forking a process that is already running Streamlit's threads is not safe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    def _restart(self, broken):
+        """Replace a broken pool with a fresh one, unless another thread already did"""
+        with self.lock:
+            if self.executor is not broken:
+                return
+            logger.warning("Encoding worker pool is broken (a worker died), starting a new one")
+            self.executor = self._start_pool()
+        # Outside the lock: cancelling queued jobs runs their _release callbacks
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def _submit(self, job, *args):
+        """Queue a job, holding one slot until it finishes. Returns (executor, future)"""
+        if not self.slots.acquire(blocking=False):
+            raise EncodingServiceBusy("Too many face checks in progress, please try again in a moment")
+        with self.lock:
+            self.pending += 1
+        try:
+            executor = self.executor
+            try:
+                future = executor.submit(job, *args)
+            except BrokenProcessPool:
+                self._restart(executor)
+                executor = self.executor
+                future = executor.submit(job, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return executor, future
+
+    def _run(self, timeout, job, *args):
+        """Run a job on the pool and wait for its result, retrying once on a fresh pool if it broke"""
+        try:
+            executor, future = self._submit(job, *args)
+            try:
+                return future.result(timeout=timeout)
+            except BrokenProcessPool:
+                self._restart(executor)
+                return self._submit(job, *args)[1].result(timeout=timeout)
+        except futures.TimeoutError:
+            # Distinct from the builtin TimeoutError before Python 3.11
+            raise TimeoutError(f"Face analysis did not finish within {timeout:.0f}s") from None
+
+    def submit(self, frame, num_jitters=1, scale=None, model=None, gallery=None, tolerance=0.6):
+        """Queue a frame (bytes) for encoding and return the future of (encoding, report)"""
+        args = _encode_args(frame, num_jitters, scale, model, gallery, tolerance)
+        return self._submit(_encode_job, *args)[1]
+
+    def warm_up(self):
+        """Start every worker now; each loads the models in its initializer.
+
+        The pool only spawns processes as jobs arrive, so without this the
+        first face checks after setup would wait for the model load.
+        """
+        return [self.executor.submit(_ping) for _ in range(self.max_workers)]
+
+    def encode(self, frame, num_jitters=1, scale=None, model=None, gallery=None, tolerance=0.6):
+        """Encode a frame on the pool and wait for it; raises TimeoutError after `timeout` seconds"""
+        args = _encode_args(frame, num_jitters, scale, model, gallery, tolerance)
+        return self._run(self.timeout, _encode_job, *args)
+
+    def encode_uploads(self, uploads, num_jitters=1, scale=None, model=None, timeout=DEFAULT_CLIP_TIMEOUT):
+        """Encode uploaded photos and video clips (frames sampled evenly) in one batch on a worker.
+
+        uploads are file-like objects with .name and .getvalue(). Returns
+        vision.encode_batch's (encodings, report).
+        """
+        uploads = [(upload.name, upload.getvalue()) for upload in uploads]
+        return self._run(timeout, _enroll_job, uploads, num_jitters, *_detection_args(scale, model))
+
+    def verify_clip(self, source, gallery, tolerance=0.6, scale=None, model=None, timeout=DEFAULT_CLIP_TIMEOUT):
+        """Identify the person in a video on a worker with streaming.verify_stream.
+
+        source is an uploaded clip or the index of a camera on the server.
+        Returns verify_stream's (name, distance, report).
+        """
+        if hasattr(source, "getvalue"):
+            source = (getattr(source, "name", ""), source.getvalue())
+        return self._run(
+            timeout, _stream_job, source, *_gallery_args(gallery), tolerance, *_detection_args(scale, model)
+        )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,180 @@
+from assignment import RuleChecker, find_assignment, is_valid_assignment, sample_assignment
+from registry import ParticipantRegistry
+
+# "uniform" draws uniformly over all valid assignments, "fast" takes the first random one found,
+# "history" avoids repeating or reversing the pairs of past draws (see history.py)
+SAMPLERS = ("uniform", "fast", "history")
+
+
+class GiftExchange:
+    """Participants, gifting rules and the current assignment, without any Streamlit state.
+
+    secret_gift.py keeps one of these per browser session; benchmarks and
+    scripts can drive the exact same logic directly. Everything is keyed by
+    the stable participant IDs of a ParticipantRegistry, so renames and
+    removals never have to rewrite rules or the assignment. The registry is
+    the only copy of the rules; rule changes go through a RuleChecker on the
+    same registry, which rejects the ones that leave no valid assignment.
+    """
+
+    def __init__(self, participants=(), restrictions=None, mandates=None, sampler="uniform", history_loader=None):
+        if sampler not in SAMPLERS:
+            raise ValueError(f"Unknown sampler: {sampler}")
+        self.registry = ParticipantRegistry()
+        self.checker = RuleChecker(self.registry)
+        self.assignment = None  # giver id -> receiver id
+        self.sampler = sampler
+        # Past draws as {giver name: receiver name}, most recent first; used by the "history" sampler
+        self.history = []
+        # Called with no arguments before every "history" draw to refresh self.history, e.g. history.load_history
+        self.history_loader = history_loader
+        self.add_participants(participants)
+        for giver, receiver in (mandates or {}).items():
+            ok, conflict = self.add_mandate(giver, receiver)
+            if not ok:
+                raise ValueError(f"{giver} must gift to {receiver}: {conflict}")
+        for giver, restricted in (restrictions or {}).items():
+            for receiver in restricted:
+                ok, conflict = self.add_restriction(giver, receiver)
+                if not ok:
+                    raise ValueError(f"{giver} can't gift to {receiver}: {conflict}")
+
+    @property
+    def participants(self):
+        """Names in the order they were added"""
+        return list(self.registry.names.values())
+
+    @property
+    def restrictions(self):
+        """{giver name: [receiver names]}"""
+        names = self.registry.names
+        return {names[g]: [names[r] for r in restricted] for g, restricted in self.registry.restrictions.items()}
+
+    @property
+    def mandates(self):
+        """{giver name: receiver name}"""
+        names = self.registry.names
+        return {names[g]: names[r] for g, r in self.registry.mandates.items()}
+
+    @property
+    def combination(self):
+        """The assignment as a tuple of receiver names aligned with `participants`, or None"""
+        if self.assignment is None:
+            return None
+        names = self.registry.names
+        return tuple(names[self.assignment[pid]] for pid in names)
+
+    def add_participants(self, names):
+        """Add new names, skipping ones already taking part. Returns how many were added"""
+        added = 0
+        for name in names:
+            if name not in self.registry:
+                self.checker.add_participant(self.registry.add(name))
+                added += 1
+        if added:
+            self.assignment = None
+        return added
+
+    def rename_participant(self, old_name, new_name):
+        """Rename someone; their rules and assignment follow because they are keyed by ID"""
+        return self.registry.rename(old_name, new_name)
+
+    def remove_participant(self, name):
+        """Remove a participant and every rule that mentions them"""
+        if name not in self.registry:
+            return
+        self.checker.remove_participant(self.registry.remove(name))
+        self.assignment = None
+
+    def add_restriction(self, giver, receiver):
+        """giver can't gift to receiver. Returns (ok, conflict explanation)"""
+        gid, rid = self.registry.id_of(giver), self.registry.id_of(receiver)
+        ok, conflict = self.checker.add_restriction(gid, rid)
+        if ok and self.assignment is not None and self.assignment[gid] == rid:
+            # The current assignment breaks the new rule; the next ensure_assignment() draws again
+            self.assignment = None
+        return ok, conflict
+
+    def add_mandate(self, giver, receiver):
+        """giver must gift to receiver. Returns (ok, conflict explanation)"""
+        gid, rid = self.registry.id_of(giver), self.registry.id_of(receiver)
+        ok, conflict = self.checker.add_mandate(gid, rid)
+        if ok and self.assignment is not None and self.assignment[gid] != rid:
+            self.assignment = None
+        return ok, conflict
+
+    def remove_restriction(self, giver, receiver):
+        self.checker.remove_restriction(self.registry.id_of(giver), self.registry.id_of(receiver))
+
+    def remove_mandate(self, giver):
+        self.checker.remove_mandate(self.registry.id_of(giver))
+
+    def restriction_page(self, offset, limit):
+        """A page of (giver id, receiver id, giver name, receiver name) restrictions for the rule editor"""
+        names = self.registry.names
+        page = []
+        for i, (giver, receiver) in enumerate(self.registry.iter_restrictions()):
+            if i >= offset + limit:
+                break
+            if i >= offset:
+                page.append((giver, receiver, names[giver], names[receiver]))
+        return page
+
+    def mandate_page(self, offset, limit):
+        """A page of (giver id, receiver id, giver name, receiver name) mandates for the rule editor"""
+        names = self.registry.names
+        items = list(self.registry.mandates.items())[offset:offset + limit]
+        return [(giver, receiver, names[giver], names[receiver]) for giver, receiver in items]
+
+    def conflict(self):
+        """Why no valid assignment exists, or None if one does"""
+        return self.checker.conflict()
+
+    def is_valid(self, combination):
+        return is_valid_assignment(self.participants, combination, self.restrictions, self.mandates)
+
+    def draw(self, previous=None, rng=None):
+        """Draw a new assignment. Returns False if none is possible"""
+        registry = self.registry
+        givers = list(registry.names)
+        start = None
+        if previous is not None:
+            start = tuple(previous[pid] for pid in givers)
+        if self.sampler == "history":
+            from history import history_assignment  # needs numpy
+
+            if self.history_loader is not None:
+                # Draws may have been recorded since the last one, possibly by another session
+                self.history = self.history_loader()
+            ids = registry.ids
+            history = [
+                {ids[giver]: ids[receiver] for giver, receiver in pairs.items() if giver in ids and receiver in ids}
+                for pairs in self.history
+            ]
+            receivers = history_assignment(givers, registry.restrictions, registry.mandates, history, rng=rng)
+        elif self.sampler == "uniform":
+            # Continuing the swap chain from the previous draw keeps a reshuffle cheap
+            receivers = sample_assignment(givers, registry.restrictions, registry.mandates, start=start, rng=rng)
+        else:
+            receivers = find_assignment(givers, registry.restrictions, registry.mandates, rng=rng)
+        if receivers is None:
+            return False
+        self.assignment = dict(zip(givers, receivers))
+        return True
+
+    def ensure_assignment(self):
+        """Draw an assignment if there is none yet. Returns False if none is possible"""
+        return self.assignment is not None or self.draw()
+
+    def reshuffle(self, rng=None):
+        previous, self.assignment = self.assignment, None
+        return self.draw(previous, rng=rng)
+
+    def pairs(self):
+        """The current assignment as {giver name: receiver name}"""
+        names = self.registry.names
+        return {names[giver]: names[receiver] for giver, receiver in self.assignment.items()}
+
+    def recipient_of(self, name):
+        registry = self.registry
+        return registry.name_of(self.assignment[registry.id_of(name)])
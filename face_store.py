@@ -0,0 +1,383 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from gallery import ENCODING_SIZE, FaceGallery
+
+# Raw little-endian float32 rows, one 128-d encoding per row, append-only.
+# Compaction writes a new generation of the file instead of touching the live one.
+MATRIX_SUFFIX = ".{generation}.f32"
+# Write-ahead log of the changes since the checkpoint, one JSON record per line, per generation
+WAL_SUFFIX = ".{generation}.wal"
+# Checkpoint mapping names to rows of the matrix file, replaced atomically by compaction
+INDEX_SUFFIX = ".index.json"
+# Held by whichever process is writing; readers never take it
+LOCK_SUFFIX = ".lock"
+# Rewrite the matrix once this fraction of its rows no longer belongs to anyone
+COMPACT_DEAD_RATIO = 0.5
+# Fold the log into a new checkpoint once it holds this many records
+COMPACT_WAL_RECORDS = 1000
+# A reader retries this many times if compaction swaps generations while it reads
+SNAPSHOT_RETRIES = 10
+
+ROW_DTYPE = np.dtype("<f4")
+ROW_BYTES = ENCODING_SIZE * ROW_DTYPE.itemsize
+
+logger = logging.getLogger(__name__)
+
+
+def _atomic_write(path, data):
+    """Write bytes to a temp file next to `path` and rename it into place"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class _FileLock:
+    """Exclusive lock on a file, shared by every process using the store; re-entrant within one process"""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, "a+b")
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                else:
+                    while True:
+                        try:
+                            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            # LK_LOCK gives up after ~10 seconds; keep waiting
+                            continue
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+class FaceStore:
+    """Binary on-disk face gallery that several processes can share.
+
+    Encodings live in an append-only float32 matrix file. Names map to its
+    rows through a checkpoint index plus a write-ahead log of the changes
+    since, so registering a face appends one row and one short log record.
+    Writers take an exclusive file lock, so concurrent registrations from
+    different processes or sessions all survive. Readers take no lock: the
+    matrix rows are written before the log record that points at them, a
+    torn last record is ignored, and if compaction replaces the generation
+    mid-read the read is retried, so every reader sees a consistent snapshot.
+    Compaction folds the log into a new checkpoint and drops rows orphaned by
+    re-registration, rename or removal. A face_data.json from the old format
+    is migrated automatically.
+
+    gallery() keeps one in-memory copy and only replays log records it has not
+    seen yet, so one instance can be shared by every session in the process.
+    """
+
+    def __init__(self, base_path="face_data"):
+        self.base_path = base_path
+        self.index_path = base_path + INDEX_SUFFIX
+        self.legacy_path = base_path + ".json"
+        self.lock = threading.RLock()
+        self.file_lock = _FileLock(base_path + LOCK_SUFFIX)
+        self._gallery = None
+        # Replayed state: checkpoint plus the log up to _wal_offset
+        self._synced = False
+        self._checkpoint = None
+        self._generation = 0
+        self._rows = {}
+        self._count = 0
+        self._wal_offset = 0
+        self._wal_records = 0
+
+    def _matrix_path(self, generation):
+        return self.base_path + MATRIX_SUFFIX.format(generation=generation)
+
+    def _wal_path(self, generation):
+        return self.base_path + WAL_SUFFIX.format(generation=generation)
+
+    def _checkpoint_signature(self):
+        """Identify the current checkpoint file; it is replaced (new inode/mtime) by every compaction"""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"rows": {}, "count": 0, "generation": 0}
+
+    def _write_index(self, rows, count, generation):
+        data = json.dumps({"rows": rows, "count": count, "generation": generation}).encode("utf-8")
+        _atomic_write(self.index_path, data)
+
+    @staticmethod
+    def _apply_record(rows, count, record):
+        """Replay one log record onto a {name: row} map; returns the new row count"""
+        op = record["op"]
+        if op == "put":
+            for offset, name in enumerate(record["names"]):
+                rows[name] = record["row"] + offset
+            return max(count, record["row"] + len(record["names"]))
+        if op == "rename":
+            if record["old"] in rows:
+                rows[record["new"]] = rows.pop(record["old"])
+        elif op == "remove":
+            rows.pop(record["name"], None)
+        return count
+
+    @staticmethod
+    def _read_records(wal, offset):
+        """Complete records after `offset`, and the offset just past the last one; a torn tail is left alone"""
+        wal.seek(offset)
+        data = wal.read()
+        end = data.rfind(b"\n") + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line]
+        return records, offset + end
+
+    def _read_snapshot(self):
+        """Read checkpoint and log as one consistent state, retrying around concurrent compactions"""
+        for _ in range(SNAPSHOT_RETRIES):
+            signature = self._checkpoint_signature()
+            index = self._read_index()
+            rows, count, generation = index["rows"], index["count"], index["generation"]
+            records, offset = [], 0
+            try:
+                with open(self._wal_path(generation), "rb") as wal:
+                    records, offset = self._read_records(wal, 0)
+            except FileNotFoundError:
+                pass  # nothing logged since the checkpoint
+            # A compaction in between would have replaced the checkpoint before deleting this log
+            if self._checkpoint_signature() != signature:
+                continue
+            for record in records:
+                count = self._apply_record(rows, count, record)
+            return signature, generation, rows, count, offset, len(records)
+        raise RuntimeError(f"Could not get a consistent snapshot of {self.base_path}, it keeps being compacted")
+
+    def _open_matrix(self, generation, count):
+        if count == 0:
+            return np.empty((0, ENCODING_SIZE), dtype=ROW_DTYPE)
+        # Copy-on-write: pages are only copied if the in-memory gallery changes them
+        return np.memmap(self._matrix_path(generation), dtype=ROW_DTYPE, mode="c", shape=(count, ENCODING_SIZE))
+
+    def _read_rows(self, generation, row, count):
+        return np.fromfile(self._matrix_path(generation), dtype=ROW_DTYPE, count=count * ENCODING_SIZE,
+                           offset=row * ROW_BYTES).reshape(count, ENCODING_SIZE)
+
+    def _migrate_legacy(self):
+        """Import face_data.json into the binary store and keep the JSON as a backup"""
+        if os.path.exists(self.index_path) or not os.path.exists(self.legacy_path):
+            return
+        with self.file_lock:
+            if os.path.exists(self.index_path) or not os.path.exists(self.legacy_path):
+                return
+            with open(self.legacy_path, "r") as f:
+                face_data = json.load(f)
+            names = list(face_data)
+            matrix = np.asarray([face_data[name] for name in names], dtype=ROW_DTYPE).reshape(-1, ENCODING_SIZE)
+            _atomic_write(self._matrix_path(0), matrix.tobytes())
+            self._write_index({name: row for row, name in enumerate(names)}, len(names), 0)
+            os.replace(self.legacy_path, self.legacy_path + ".migrated")
+            logger.info(f"Migrated {len(names)} face encodings from {self.legacy_path}")
+
+    def load(self):
+        """Load a consistent snapshot of the gallery without parsing or copying the encodings"""
+        self._migrate_legacy()
+        for _ in range(SNAPSHOT_RETRIES):
+            _, generation, rows, count, _, _ = self._read_snapshot()
+            try:
+                return self._build_gallery(generation, rows, count)
+            except FileNotFoundError:
+                continue  # compacted away between reading the index and opening the matrix
+        raise RuntimeError(f"Could not get a consistent snapshot of {self.base_path}, it keeps being compacted")
+
+    def _build_gallery(self, generation, rows, count):
+        matrix = self._open_matrix(generation, count)
+        names = sorted(rows, key=rows.get)
+        if [rows[name] for name in names] == list(range(count)):
+            return FaceGallery.from_matrix(names, matrix)
+        # Dead rows are still on disk, so gather the live ones
+        return FaceGallery.from_matrix(names, np.asarray(matrix[[rows[name] for name in names]], dtype=np.float32))
+
+    def _refresh(self):
+        """Catch up with changes made by other processes.
+
+        New log records of the same generation are replayed onto the cached
+        gallery in place; a new checkpoint (compaction elsewhere) drops the
+        cache so the next gallery() reloads it.
+        """
+        if self._synced and self._checkpoint_signature() == self._checkpoint:
+            wal_path = self._wal_path(self._generation)
+            try:
+                # Nothing appended since the last call: an idle rerun stops at two stat() calls
+                if os.stat(wal_path).st_size <= self._wal_offset:
+                    return
+                with open(wal_path, "rb") as wal:
+                    records, offset = self._read_records(wal, self._wal_offset)
+            except FileNotFoundError:
+                records, offset = [], self._wal_offset
+            # Still the same generation, so the records belong to what we already replayed
+            if self._checkpoint_signature() == self._checkpoint:
+                for record in records:
+                    self._replay(record)
+                self._wal_offset = offset
+                return
+        self._migrate_legacy()
+        snapshot = self._read_snapshot()
+        self._checkpoint, self._generation, self._rows, self._count, self._wal_offset, self._wal_records = snapshot
+        self._synced = True
+        self._gallery = None
+
+    def _replay(self, record, encodings=None):
+        """Apply a log record to the replayed index and, if loaded, the cached gallery"""
+        self._count = self._apply_record(self._rows, self._count, record)
+        self._wal_records += 1
+        if self._gallery is None:
+            return
+        if record["op"] == "put":
+            if encodings is None:
+                encodings = self._read_rows(self._generation, record["row"], len(record["names"]))
+            for name, encoding in zip(record["names"], encodings):
+                self._gallery.add(name, encoding)
+        elif record["op"] == "rename":
+            self._gallery.rename(record["old"], record["new"])
+        elif record["op"] == "remove":
+            self._gallery.remove(record["name"])
+
+    def gallery(self):
+        """Return the cached gallery, replaying only what changed on disk since the last call"""
+        with self.lock:
+            try:
+                self._refresh()
+                if self._gallery is None:
+                    self._gallery = self._build_gallery(self._generation, self._rows, self._count)
+            except FileNotFoundError:
+                # Compacted away between reading the log and opening the matrix
+                self._synced = False
+                self._refresh()
+                self._gallery = self._build_gallery(self._generation, self._rows, self._count)
+            return self._gallery
+
+    def _log(self, record, encodings=None):
+        """Append a record to the log (caller holds the file lock and has refreshed) and apply it"""
+        with open(self._wal_path(self._generation), "ab") as wal:
+            # Drop a record torn by a crashed writer; everything before _wal_offset is complete
+            wal.truncate(self._wal_offset)
+            line = (json.dumps(record) + "\n").encode("utf-8")
+            wal.write(line)
+            wal.flush()
+            os.fsync(wal.fileno())
+        self._wal_offset += len(line)
+        self._replay(record, encodings)
+        self._maybe_compact()
+
+    def append(self, name, encoding):
+        """Store a (re-)registered encoding by appending one row"""
+        self.append_many({name: encoding})
+
+    def append_many(self, encodings):
+        """Store several {name: encoding} registrations with one write and one log record"""
+        names = list(encodings)
+        matrix = np.asarray([encodings[name] for name in names], dtype=ROW_DTYPE).reshape(-1, ENCODING_SIZE)
+        with self.lock, self.file_lock:
+            self._refresh()
+            with open(self._matrix_path(self._generation), "ab") as f:
+                # Drop rows written after the last committed record (a crash mid-append)
+                f.truncate(self._count * ROW_BYTES)
+                f.write(matrix.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            # The rows are on disk before the record that makes them visible
+            self._log({"op": "put", "names": names, "row": self._count}, matrix)
+
+    def rename(self, old_name, new_name):
+        with self.lock, self.file_lock:
+            self._refresh()
+            if old_name in self._rows and old_name != new_name:
+                self._log({"op": "rename", "old": old_name, "new": new_name})
+
+    def remove(self, name):
+        with self.lock, self.file_lock:
+            self._refresh()
+            if name in self._rows:
+                self._log({"op": "remove", "name": name})
+
+    def _maybe_compact(self):
+        dead = self._count - len(self._rows)
+        if self._wal_records >= COMPACT_WAL_RECORDS or (self._count and dead / self._count >= COMPACT_DEAD_RATIO):
+            self.compact()
+
+    def compact(self):
+        """Copy the live rows into a new generation with a fresh checkpoint and an empty log.
+
+        The old matrix and log are only deleted after the new checkpoint is in
+        place, so a crash at any point leaves a consistent generation, and a
+        reader that already opened the old files keeps a valid snapshot.
+        """
+        with self.lock, self.file_lock:
+            self._refresh()
+            generation = self._generation
+            names = sorted(self._rows, key=self._rows.get)
+            matrix = self._open_matrix(generation, self._count)
+            live = np.asarray(matrix[[self._rows[name] for name in names]], dtype=ROW_DTYPE) if names else matrix[:0]
+            del matrix
+            _atomic_write(self._matrix_path(generation + 1), live.tobytes())
+            _atomic_write(self._wal_path(generation + 1), b"")
+            rows = {name: row for row, name in enumerate(names)}
+            self._write_index(rows, len(names), generation + 1)
+            for path in (self._matrix_path(generation), self._wal_path(generation)):
+                if os.path.exists(path):
+                    os.remove(path)
+            # Same names and encodings, so the cached gallery stays valid
+            self._checkpoint = self._checkpoint_signature()
+            self._generation, self._rows, self._count = generation + 1, rows, len(names)
+            self._wal_offset = self._wal_records = 0
+            logger.info(f"Compacted {self.base_path} to generation {generation + 1} with {len(names)} faces")
@@ -0,0 +1,81 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+# Defaults sized for a kiosk: a few hundred frames is far more than one event produces
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def frame_key(frame, **params):
+    """Cache key for a frame: a hash of its bytes plus every parameter that changes the result"""
+    digest = hashlib.blake2b(frame, digest_size=16).hexdigest()
+    return (digest,) + tuple(sorted(params.items()))
+
+
+def _entry_size(value):
+    encoding, report = value
+    size = sys.getsizeof(report) + sum(sys.getsizeof(v) for v in report.values())
+    if encoding is not None:
+        size += encoding.nbytes
+    return size
+
+
+class FrameCache:
+    """Bounded LRU cache of (encoding, report) results keyed by frame content.
+
+    st.camera_input keeps returning the same photo on every rerun, so any
+    widget click would otherwise redo detection and encoding on identical
+    bytes. Entries are evicted by count and by approximate memory use.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value[0]
+
+    def put(self, key, value):
+        size = _entry_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def get_or_compute(self, frame, compute, **params):
+        """Return the cached result for this frame and parameters, computing it on a miss"""
+        key = frame_key(frame, **params)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,177 @@
+import logging
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+ENCODING_SIZE = 128
+# Same default as face_recognition.compare_faces
+DEFAULT_TOLERANCE = 0.6
+# Galleries smaller than this are searched exactly even when an ANN backend is requested
+ANN_MIN_SIZE = 2000
+
+logger = logging.getLogger(__name__)
+
+
+class _HnswIndex:
+    """Approximate nearest-neighbour index over the gallery, backed by hnswlib."""
+
+    def __init__(self, capacity):
+        self.index = hnswlib.Index(space="l2", dim=ENCODING_SIZE)
+        self.index.init_index(max_elements=max(capacity, 1024), ef_construction=200, M=16, allow_replace_deleted=True)
+        self.index.set_ef(64)
+        self.labels = {}
+        self.names = {}
+        self.next_label = 0
+
+    def upsert(self, name, encoding):
+        self.remove(name)
+        if self.index.get_current_count() >= self.index.get_max_elements():
+            self.index.resize_index(self.index.get_max_elements() * 2)
+        label = self.next_label
+        self.next_label += 1
+        self.index.add_items(encoding[np.newaxis, :], [label], replace_deleted=True)
+        self.labels[name] = label
+        self.names[label] = name
+
+    def remove(self, name):
+        label = self.labels.pop(name, None)
+        if label is not None:
+            self.index.mark_deleted(label)
+            del self.names[label]
+
+    def rename(self, old_name, new_name):
+        label = self.labels.pop(old_name)
+        self.labels[new_name] = label
+        self.names[label] = new_name
+
+    def nearest(self, encoding):
+        labels, distances = self.index.knn_query(encoding[np.newaxis, :], k=1)
+        # hnswlib reports squared L2 distances
+        return self.names[int(labels[0][0])], float(np.sqrt(distances[0][0]))
+
+
+class FaceGallery:
+    """All registered face encodings in one contiguous float32 (N x 128) matrix.
+
+    Rows are updated in place on register, rename and remove so identification
+    is a single batched distance computation instead of a per-name loop.
+    Pass backend="hnsw" to use an approximate index for very large galleries
+    (requires the optional hnswlib package).
+    """
+
+    def __init__(self, backend="exact"):
+        self.names = []
+        self.rows = {}
+        self.matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.ann = None
+        if backend == "hnsw":
+            if hnswlib is None:
+                logger.warning("hnswlib is not installed, falling back to exact face search")
+            else:
+                self.ann = _HnswIndex(ANN_MIN_SIZE)
+        elif backend != "exact":
+            raise ValueError(f"Unknown gallery backend: {backend}")
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def get(self, name):
+        row = self.rows.get(name)
+        return None if row is None else self.matrix[row]
+
+    def add(self, name, encoding):
+        """Register or replace the encoding stored for a name"""
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+        row = self.rows.get(name)
+        if row is None:
+            row = len(self.names)
+            if row == self.matrix.shape[0]:
+                # Grow geometrically so repeated registrations stay amortized O(1)
+                grown = np.empty((max(8, row * 2), ENCODING_SIZE), dtype=np.float32)
+                grown[:row] = self.matrix[:row]
+                self.matrix = grown
+            self.names.append(name)
+            self.rows[name] = row
+        self.matrix[row] = encoding
+        if self.ann is not None:
+            self.ann.upsert(name, encoding)
+
+    def rename(self, old_name, new_name):
+        if old_name not in self.rows or old_name == new_name:
+            return
+        self.remove(new_name)
+        row = self.rows.pop(old_name)
+        self.names[row] = new_name
+        self.rows[new_name] = row
+        if self.ann is not None:
+            self.ann.rename(old_name, new_name)
+
+    def remove(self, name):
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        # Move the last row into the hole to keep the matrix contiguous
+        last = len(self.names) - 1
+        if row != last:
+            moved = self.names[last]
+            self.matrix[row] = self.matrix[last]
+            self.names[row] = moved
+            self.rows[moved] = row
+        self.names.pop()
+        if self.ann is not None:
+            self.ann.remove(name)
+
+    def distances(self, encoding):
+        """Euclidean distance from an encoding to every registered face, in row order"""
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+        return np.linalg.norm(self.matrix[:len(self.names)] - encoding, axis=1)
+
+    def identify(self, encoding, tolerance=DEFAULT_TOLERANCE):
+        """Return (name, distance) of the closest registered face.
+
+        name is None when the gallery is empty or the closest face is not
+        within `tolerance`.
+        """
+        if not self.names:
+            return None, float("inf")
+        if self.ann is not None and len(self.names) >= ANN_MIN_SIZE:
+            name, distance = self.ann.nearest(np.asarray(encoding, dtype=np.float32))
+        else:
+            distances = self.distances(encoding)
+            best = int(np.argmin(distances))
+            name, distance = self.names[best], float(distances[best])
+        if distance > tolerance:
+            return None, distance
+        return name, distance
+
+    @classmethod
+    def from_matrix(cls, names, matrix, backend="exact"):
+        """Wrap an existing (N x 128) float32 matrix, e.g. a memory map, without copying it"""
+        gallery = cls(backend)
+        gallery.names = list(names)
+        gallery.rows = {name: row for row, name in enumerate(gallery.names)}
+        gallery.matrix = matrix
+        if gallery.ann is not None:
+            for name, row in gallery.rows.items():
+                gallery.ann.upsert(name, matrix[row])
+        return gallery
+
+    def to_dict(self):
+        return {name: self.matrix[row].tolist() for name, row in self.rows.items()}
+
+    @classmethod
+    def from_dict(cls, data, backend="exact"):
+        gallery = cls(backend)
+        for name, encoding in data.items():
+            gallery.add(name, encoding)
+        return gallery
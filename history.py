@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import random
+from datetime import datetime
+
+import numpy as np
+
+from assignment import build_constraints
+from face_store import _atomic_write
+
+HISTORY_PATH = "assignment_history.json"
+# Cost of giving to last year's recipient; each older draw counts HISTORY_DECAY times less
+REPEAT_PENALTY = 100.0
+# Cost of giving to the person who gave to you in a past draw (A->B last year, B->A now)
+RECIPROCAL_PENALTY = 50.0
+HISTORY_DECAY = 0.5
+# Only the most recent draws are taken into account
+HISTORY_DEPTH = 5
+
+logger = logging.getLogger(__name__)
+
+
+def load_history(path=HISTORY_PATH):
+    """Past draws as a list of {giver: receiver} dicts, most recent first"""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        draws = json.load(f).get("draws", [])
+    draws.sort(key=lambda draw: draw.get("drawn_at", ""), reverse=True)
+    return [draw["pairs"] for draw in draws]
+
+
+def record_assignment(pairs, path=HISTORY_PATH, drawn_at=None):
+    """Append a final draw ({giver: receiver}) to the history file"""
+    draws = []
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            draws = json.load(f).get("draws", [])
+    draws.append({
+        "drawn_at": (drawn_at or datetime.now()).isoformat(timespec="seconds"),
+        "pairs": dict(pairs),
+    })
+    _atomic_write(path, json.dumps({"draws": draws}, indent=2).encode("utf-8"))
+    logger.info(f"Recorded a draw of {len(pairs)} pairs in {path}, {len(draws)} draws in total")
+
+
+def history_costs(participants, history, depth=HISTORY_DEPTH):
+    """n x n penalty matrix (giver row, receiver column) for repeating or reversing past pairs"""
+    index = {name: i for i, name in enumerate(participants)}
+    n = len(participants)
+    costs = np.zeros((n, n))
+    for age, pairs in enumerate(history[:depth]):
+        weight = HISTORY_DECAY ** age
+        gi, ri = [], []
+        for giver, receiver in pairs.items():
+            if giver in index and receiver in index:
+                gi.append(index[giver])
+                ri.append(index[receiver])
+        # np.add.at accumulates repeated indices, e.g. when two past draws hold the same pair
+        np.add.at(costs, (gi, ri), REPEAT_PENALTY * weight)
+        np.add.at(costs, (ri, gi), RECIPROCAL_PENALTY * weight)
+    return costs
+
+
+def _augment(cost, u, v, row4col, col4row, start):
+    """Extend the assignment by row `start` along a shortest augmenting path (Jonker-Volgenant).
+
+    Dijkstra over columns with reduced costs cost - u - v, one vectorized
+    relaxation per visited row. Updates the potentials and the assignment in
+    place. Returns False if `start` can reach no free column.
+    """
+    n = cost.shape[1]
+    shortest = np.full(n, np.inf)
+    path = np.full(n, -1)
+    visited = np.zeros(n, dtype=bool)
+    rows = []
+    i, min_val, sink = start, 0.0, -1
+    while sink < 0:
+        rows.append(i)
+        reduced = min_val + cost[i] - u[i] - v
+        better = ~visited & (reduced < shortest)
+        path[better] = i
+        shortest[better] = reduced[better]
+        candidates = np.where(visited, np.inf, shortest)
+        min_val = candidates.min()
+        if min_val == np.inf:
+            return False
+        # Among equally short columns take a free one: most pairs cost the same, so this
+        # usually ends the search after one step
+        ties = np.flatnonzero(candidates == min_val)
+        free = ties[row4col[ties] < 0]
+        j = int(free[0] if len(free) else ties[0])
+        visited[j] = True
+        if row4col[j] < 0:
+            sink = j
+        else:
+            i = row4col[j]
+
+    u[start] += min_val
+    others = np.array(rows[1:], dtype=int)
+    if len(others):
+        u[others] += min_val - shortest[col4row[others]]
+    v[visited] -= min_val - shortest[visited]
+
+    j = sink
+    while True:
+        i = path[j]
+        row4col[j] = i
+        col4row[i], j = j, col4row[i]
+        if i == start:
+            return True
+
+
+def linear_assignment(cost):
+    """Minimum cost perfect matching of a square cost matrix; np.inf marks forbidden pairs.
+
+    Row i starts on column i wherever that pair is already as cheap as the
+    row allows (callers shuffle rows and columns, so this is a random
+    matching), then on its cheapest column if that is still free. The rest
+    is completed with shortest augmenting paths, typically a single
+    vectorized pass per row when many pairs cost the same. Returns the
+    column assigned to each row, or None when no perfect matching avoids the
+    forbidden pairs.
+    """
+    n = cost.shape[0]
+    col4row = np.full(n, -1)
+    row4col = np.full(n, -1)
+    if n == 0:
+        return col4row
+    v = cost.min(axis=0)
+    if np.isinf(v).any():
+        return None
+    u = (cost - v).min(axis=1)
+    if np.isinf(u).any():
+        return None
+
+    # Only pairs with zero reduced cost may start out matched
+    diagonal = np.arange(n)
+    tight = cost[diagonal, diagonal] - v == u
+    col4row[tight] = diagonal[tight]
+    row4col[tight] = diagonal[tight]
+    cheapest = cost.argmin(axis=0)
+    for j in np.flatnonzero(row4col < 0):
+        i = cheapest[j]
+        if col4row[i] < 0 and cost[i, j] - v[j] == u[i]:
+            col4row[i] = j
+            row4col[j] = i
+
+    for i in np.flatnonzero(col4row < 0):
+        if not _augment(cost, u, v, row4col, col4row, i):
+            return None
+    return col4row
+
+
+def _break_two_cycles(receivers, costs, movable, rng):
+    """Swap receivers to undo A->B, B->A pairs without adding history penalty.
+
+    receivers[g] is the receiver index of giver g and is changed in place;
+    costs has np.inf on forbidden pairs and only `movable` givers (those
+    without a mandate) may change receivers. Returns how many cycles were broken.
+    """
+    n = len(receivers)
+    broken = 0
+    for a in rng.sample(range(n), n):
+        b = receivers[a]
+        if receivers[b] != a or not movable[a]:
+            continue
+        # Swap with giver c -> d into a -> d, c -> b, as long as no new pair reverses another
+        c = np.flatnonzero(movable)
+        d = receivers[c]
+        ok = (
+            (c != a) & (c != b) & (d != a)
+            & (receivers[d] != a) & (receivers[b] != c)
+            & (costs[a, d] + costs[c, b] <= costs[a, b] + costs[c, d])
+        )
+        options = c[ok]
+        if len(options):
+            c = options[rng.randrange(len(options))]
+            receivers[a], receivers[c] = receivers[c], b
+            broken += 1
+    return broken
+
+
+def history_assignment(participants, restrictions, mandates, history, rng=None):
+    """Draw the assignment that repeats or reverses as few recent pairs as possible.
+
+    Restrictions and mandates are honoured exactly; among the cheapest
+    assignments one is picked at random (by shuffling the order the solver
+    sees givers and receivers in, since it breaks ties by position), then
+    two-person cycles (A and B gifting each other) are swapped away where
+    that costs no extra penalty.
+    history is a list of past {giver: receiver} dicts, most recent first.
+    Returns a tuple of receivers aligned with participants, or None if no
+    valid assignment exists.
+    """
+    rng = rng or random
+    n = len(participants)
+    if n < 2:
+        return None
+    constraints = build_constraints(participants, restrictions, mandates)
+    if constraints is None:
+        return None
+    pinned, forbidden = constraints
+
+    costs = history_costs(participants, history)
+    givers = np.repeat(np.arange(n), [len(receivers) for receivers in forbidden])
+    costs[givers, np.fromiter((r for receivers in forbidden for r in receivers), dtype=int, count=len(givers))] = np.inf
+
+    # Mandated pairs are fixed; solve only for the remaining givers and receivers
+    free_givers = [i for i in range(n) if pinned[i] is None]
+    taken = {r for r in pinned if r is not None}
+    free_receivers = [r for r in range(n) if r not in taken]
+    rng.shuffle(free_givers)
+    rng.shuffle(free_receivers)
+    free_givers, free_receivers = np.array(free_givers, dtype=int), np.array(free_receivers, dtype=int)
+    columns = linear_assignment(costs[np.ix_(free_givers, free_receivers)])
+    if columns is None:
+        return None
+
+    receivers = np.array([-1 if r is None else r for r in pinned])
+    receivers[free_givers] = free_receivers[columns]
+    movable = np.array([r is None for r in pinned])
+    _break_two_cycles(receivers, costs, movable, rng)
+    return tuple(participants[r] for r in receivers)
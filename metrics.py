@@ -0,0 +1,142 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds, Prometheus style; +Inf is implied
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Metric names are exported as secret_gift_<name>
+PREFIX = "secret_gift"
+
+_NOOP = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (what Prometheus would estimate)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Process-wide stage timings and event counters for the face pipeline.
+
+    Disabled by default (set SECRET_GIFT_METRICS=1 or flip `enabled`);
+    while disabled span() hands back a shared no-op context manager and
+    observe()/count() return immediately, so the instrumentation left in the
+    hot paths costs one attribute check.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, event, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[event] = self.counters.get(event, 0) + amount
+
+    def span(self, stage):
+        """Time the body of a `with` block as one observation of `stage`"""
+        if not self.enabled:
+            return _NOOP
+        return self._span(stage)
+
+    @contextlib.contextmanager
+    def _span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe_report(self, report):
+        """Record the per-stage timings a vision frame report carries (they are measured in the worker)"""
+        if not self.enabled:
+            return
+        for key, value in report.items():
+            if key.endswith("_seconds"):
+                self.observe(key[: -len("_seconds")], value)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "taken_at": time.time(),
+                "counters": dict(self.counters),
+                "stages": {
+                    stage: {
+                        "count": h.count,
+                        "sum_seconds": h.sum,
+                        "mean_seconds": h.sum / h.count if h.count else 0.0,
+                        "p50_seconds": h.quantile(0.5),
+                        "p95_seconds": h.quantile(0.95),
+                        "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts)),
+                    }
+                    for stage, h in self.histograms.items()
+                },
+            }
+
+    def write_snapshot(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def to_prometheus(self):
+        """Render everything in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for event, value in sorted(self.counters.items()):
+                name = f"{PREFIX}_{event}_total"
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+            if self.histograms:
+                name = f"{PREFIX}_stage_seconds"
+                lines.append(f"# TYPE {name} histogram")
+                for stage, h in sorted(self.histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum}')
+                    lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(enabled=os.environ.get("SECRET_GIFT_METRICS") == "1")
@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from encoding_service import EncodingServiceBusy
+from exchange import GiftExchange
+from vision import aggregate_template
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Separates several names inside one CSV cell
+LIST_SEPARATOR = ";"
+# "Ram_2.jpg" and "Ram-2.jpg" are both photos of Ram
+_SAMPLE_SUFFIX = re.compile(r"[_-]\d+$")
+
+logger = logging.getLogger(__name__)
+
+
+def _split(cell):
+    return [name.strip() for name in (cell or "").split(LIST_SEPARATOR) if name.strip()]
+
+
+def parse_roster(data, filename):
+    """Read participants and rules from a CSV or JSON upload.
+
+    CSV: one row per participant with columns name, cant_gift_to and
+    must_gift_to; cant_gift_to may hold several names separated by ';'.
+    JSON: {"participants": [...], "restrictions": {giver: [...]}, "mandates": {giver: receiver}}.
+    Returns (participants, restrictions, mandates).
+    """
+    text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+    if filename.lower().endswith(".json"):
+        roster = json.loads(text)
+        return (
+            [name.strip() for name in roster.get("participants", []) if name.strip()],
+            {giver: list(restricted) for giver, restricted in roster.get("restrictions", {}).items()},
+            dict(roster.get("mandates", {})),
+        )
+
+    participants, restrictions, mandates = [], {}, {}
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {(key or "").strip().lower(): value for key, value in row.items()}
+        name = (row.get("name") or "").strip()
+        if not name:
+            continue
+        participants.append(name)
+        if _split(row.get("cant_gift_to")):
+            restrictions[name] = _split(row.get("cant_gift_to"))
+        mandated = (row.get("must_gift_to") or "").strip()
+        if mandated:
+            mandates[name] = mandated
+    return participants, restrictions, mandates
+
+
+def import_roster(exchange, participants, restrictions, mandates):
+    """Merge a roster into a copy of `exchange` and validate it as one transaction.
+
+    Returns (new_exchange, errors). new_exchange is None and nothing changes
+    unless every name is known and every rule can be added together with the
+    existing ones.
+    """
+    errors = []
+    candidate = GiftExchange(exchange.participants, sampler=exchange.sampler, history_loader=exchange.history_loader)
+    candidate.history = exchange.history
+    candidate.add_participants(participants)
+    known = set(candidate.participants)
+    rules = (
+        [("must", giver, receiver) for giver, receiver in {**exchange.mandates, **mandates}.items()]
+        + [("cant", giver, receiver) for giver, restricted in exchange.restrictions.items() for receiver in restricted]
+        + [("cant", giver, receiver) for giver, restricted in restrictions.items() for receiver in restricted]
+    )
+    for kind, giver, receiver in rules:
+        unknown = [name for name in (giver, receiver) if name not in known]
+        if unknown:
+            errors.append(f"Unknown participant {', '.join(unknown)} in rule {giver} -> {receiver}")
+            continue
+        if kind == "must":
+            ok, conflict = candidate.add_mandate(giver, receiver)
+            label = "must gift to"
+        else:
+            ok, conflict = candidate.add_restriction(giver, receiver)
+            label = "can't gift to"
+        if not ok:
+            errors.append(f"{giver} {label} {receiver}: {conflict}")
+    if errors:
+        return None, errors
+    return candidate, []
+
+
+def label_for(path, known=None):
+    """Participant name for a photo: its folder for Name/photo.jpg, else the file name minus a _N suffix.
+
+    With `known` names, a folder only counts as the label if it is one of
+    them, so an archive wrapped in e.g. photos/Ram.jpg still works.
+    """
+    parts = [part for part in re.split(r"[\\/]", path) if part]
+    if len(parts) > 1 and (known is None or parts[-2] in known):
+        return parts[-2]
+    stem = os.path.splitext(parts[-1])[0]
+    return _SAMPLE_SUFFIX.sub("", stem)
+
+
+def iter_photos(source):
+    """Yield (path, bytes) for every image in a directory or a zip archive (path or file object), lazily"""
+    if isinstance(source, str) and os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for filename in sorted(files):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, filename)
+                    with open(path, "rb") as f:
+                        yield os.path.relpath(path, source), f.read()
+        return
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield info.filename, archive.read(info)
+
+
+def count_photos(source):
+    if isinstance(source, str) and os.path.isdir(source):
+        return sum(
+            1 for _, _, files in os.walk(source) for filename in files if filename.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    with zipfile.ZipFile(source) as archive:
+        return sum(1 for info in archive.infolist() if info.filename.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def enroll_photos(source, service, participants=None, scale=None, model=None, progress=None):
+    """Detect and encode every labelled photo on the worker pool and build one template per person.
+
+    Photos are streamed into the pool as workers free up, so memory stays
+    bounded by the queue depth rather than the archive size. Failures (no
+    face, unknown name, unreadable file, no result within service.timeout)
+    are collected per image instead of aborting the batch. `progress(done, total)` is called after each photo.
+    Returns (templates, failures) where templates maps name -> (encoding,
+    samples used) and failures is a list of (path, reason).
+    """
+    total = count_photos(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    known = set(participants) if participants is not None else None
+    encodings, failures = {}, []
+    in_flight = {}  # future -> (path, name, deadline)
+    done = 0
+    # A photo that takes longer than a face check may (e.g. on a hung worker) is given up on
+    timeout = service.timeout
+
+    def finish(path, reason=None):
+        nonlocal done
+        if reason is not None:
+            failures.append((path, reason))
+        done += 1
+        if progress:
+            progress(done, total)
+
+    def collect(finished):
+        for future in finished:
+            path, name, _ = in_flight.pop(future)
+            try:
+                encoding, _ = future.result()
+            except Exception as e:
+                finish(path, f"Could not process image: {e}")
+            else:
+                if encoding is None:
+                    finish(path, "No face detected")
+                else:
+                    encodings.setdefault(name, []).append(encoding)
+                    finish(path)
+
+    def wait_for_any():
+        """Collect at least one finished photo, or give up on those past their deadline"""
+        deadline = min(deadline for _, _, deadline in in_flight.values())
+        finished, _ = wait(
+            list(in_flight), timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED
+        )
+        collect(finished)
+        now = time.monotonic()
+        for future, (path, _, deadline) in list(in_flight.items()):
+            if deadline <= now and not future.done():
+                future.cancel()
+                del in_flight[future]
+                finish(path, f"Timed out after {timeout:.0f}s")
+
+    starved_since = None  # since when other sessions (or hung jobs) have held every slot
+    for path, frame in iter_photos(source):
+        name = label_for(path, known)
+        if known is not None and name not in known:
+            finish(path, f"{name} is not a participant")
+            continue
+        future = None
+        while future is None:
+            try:
+                future = service.submit(frame, num_jitters=1, scale=scale, model=model)
+            except EncodingServiceBusy:
+                # Pool and queue are full: wait for a slot instead of reading more of the archive
+                if in_flight:
+                    wait_for_any()
+                    continue
+                starved_since = starved_since or time.monotonic()
+                if time.monotonic() - starved_since > timeout:
+                    break
+                time.sleep(0.1)
+        if future is None:
+            finish(path, f"Timed out after {timeout:.0f}s waiting for a free worker")
+        else:
+            starved_since = None
+            in_flight[future] = (path, name, time.monotonic() + timeout)
+
+    while in_flight:
+        wait_for_any()
+
+    templates = {name: aggregate_template(samples) for name, samples in encodings.items()}
+    logger.info(f"Bulk enrollment: {len(templates)} people from {total} photos, {len(failures)} failures")
+    return templates, failures
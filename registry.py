@@ -0,0 +1,114 @@
+import itertools
+
+
+class ParticipantRegistry:
+    """Participants with stable IDs and indexed gifting rules.
+
+    Rules are stored by participant ID, so renaming someone is a constant
+    time update of the name maps. Restrictions keep a reverse index and
+    mandates a reverse map, so removing someone cascades to every rule that
+    mentions them in time proportional to those rules only.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.names = {}          # id -> name, in the order people were added
+        self.ids = {}            # name -> id
+        self.restrictions = {}   # giver id -> set of receiver ids
+        self.restricted_by = {}  # receiver id -> set of giver ids
+        self.mandates = {}       # giver id -> receiver id
+        self.mandated_by = {}    # receiver id -> giver id
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def id_of(self, name):
+        return self.ids[name]
+
+    def name_of(self, pid):
+        return self.names[pid]
+
+    def add(self, name):
+        """Add a participant and return their ID (the existing ID if the name is taken)"""
+        if name in self.ids:
+            return self.ids[name]
+        pid = next(self._ids)
+        self.names[pid] = name
+        self.ids[name] = pid
+        return pid
+
+    def rename(self, old_name, new_name):
+        if old_name not in self.ids or old_name == new_name:
+            return False
+        if new_name in self.ids:
+            raise ValueError(f"{new_name} is already a participant")
+        pid = self.ids.pop(old_name)
+        self.ids[new_name] = pid
+        self.names[pid] = new_name
+        return True
+
+    def remove(self, name):
+        """Remove a participant and every restriction and mandate that mentions them"""
+        pid = self.ids.pop(name, None)
+        if pid is None:
+            return None
+        del self.names[pid]
+        for receiver in self.restrictions.pop(pid, ()):
+            self._unlink_restriction(pid, receiver, from_giver=False)
+        for giver in self.restricted_by.pop(pid, ()):
+            self._unlink_restriction(giver, pid, from_receiver=False)
+        receiver = self.mandates.pop(pid, None)
+        if receiver is not None:
+            del self.mandated_by[receiver]
+        giver = self.mandated_by.pop(pid, None)
+        if giver is not None:
+            del self.mandates[giver]
+        return pid
+
+    def add_restriction(self, giver, receiver):
+        self.restrictions.setdefault(giver, set()).add(receiver)
+        self.restricted_by.setdefault(receiver, set()).add(giver)
+
+    def _unlink_restriction(self, giver, receiver, from_giver=True, from_receiver=True):
+        if from_giver:
+            restricted = self.restrictions.get(giver)
+            if restricted is not None:
+                restricted.discard(receiver)
+                if not restricted:
+                    del self.restrictions[giver]
+        if from_receiver:
+            restricting = self.restricted_by.get(receiver)
+            if restricting is not None:
+                restricting.discard(giver)
+                if not restricting:
+                    del self.restricted_by[receiver]
+
+    def remove_restriction(self, giver, receiver):
+        self._unlink_restriction(giver, receiver)
+
+    def set_mandate(self, giver, receiver):
+        previous = self.mandates.get(giver)
+        if previous is not None:
+            del self.mandated_by[previous]
+        self.mandates[giver] = receiver
+        self.mandated_by[receiver] = giver
+
+    def remove_mandate(self, giver):
+        receiver = self.mandates.pop(giver, None)
+        if receiver is not None:
+            del self.mandated_by[receiver]
+
+    def is_restricted(self, giver, receiver):
+        return receiver in self.restrictions.get(giver, ())
+
+    def rule_count(self):
+        return sum(len(restricted) for restricted in self.restrictions.values()) + len(self.mandates)
+
+    def iter_restrictions(self):
+        """(giver id, receiver id) for every restriction, grouped by giver"""
+        for giver, restricted in self.restrictions.items():
+            for receiver in restricted:
+                yield giver, receiver
@@ -1,16 +1,33 @@
+import time
+_script_started = time.perf_counter()
+
 import streamlit as st
 import itertools
-import random
-import cv2
-import numpy as np
-from PIL import Image
-import face_recognition
 import logging
 import json
+import threading
 from datetime import datetime
+from exchange import SAMPLERS, GiftExchange
+from gallery import FaceGallery
+from face_store import FaceStore
+from encoding_service import EncodingService, EncodingServiceBusy
+from frame_cache import FrameCache, frame_key
+from history import load_history, record_assignment
+from metrics import metrics
+from onboarding import enroll_photos, import_roster, parse_roster
+from vision import (
+    DEFAULT_DETECTION_MODEL, DEFAULT_DETECTION_SCALE, DETECTION_MODELS, VIDEO_TYPES, aggregate_template
+)
+# Nothing above loads dlib or the face models (see vision.models()), so the setup page renders quickly
+_imports_seconds = time.perf_counter() - _script_started
 
 logging.basicConfig(level=logging.INFO)
 
+# One of exchange.SAMPLERS
+ASSIGNMENT_SAMPLER = "uniform"
+# Participants and rules shown per page in the setup editors
+EDITOR_PAGE_SIZE = 20
+
 st.set_page_config(page_title="Secret Gift Exchange", page_icon="🎁", layout="wide", initial_sidebar_state="collapsed")
 
 # CSS for better styling
@@ -58,43 +75,190 @@ st.markdown("""
 def init_session_states():
     if 'setup_complete' not in st.session_state:
         st.session_state.setup_complete = False
-    if 'participants' not in st.session_state:
-        st.session_state.participants = []
-    if 'restrictions' not in st.session_state:
-        st.session_state.restrictions = {}
-    if 'mandates' not in st.session_state:
-        st.session_state.mandates = {}
-    if 'combination' not in st.session_state:
-        st.session_state.combination = None
-    if 'face_encodings' not in st.session_state:
-        st.session_state.face_encodings = {}
+    if 'exchange' not in st.session_state:
+        # Participants, rules and the current assignment (see exchange.py)
+        st.session_state.exchange = GiftExchange(sampler=ASSIGNMENT_SAMPLER, history_loader=load_history)
+    if 'face_gallery' not in st.session_state:
+        st.session_state.face_gallery = FaceGallery()
     if 'registration_status' not in st.session_state:
         st.session_state.registration_status = {}
     if 'verified_identity' not in st.session_state:
         st.session_state.verified_identity = None
+    if 'detection_scale' not in st.session_state:
+        st.session_state.detection_scale = DEFAULT_DETECTION_SCALE
+    if 'detection_model' not in st.session_state:
+        st.session_state.detection_model = DEFAULT_DETECTION_MODEL
 
 init_session_states()
 
-def save_face_data():
-    """Save face encodings to a file"""
-    face_data = {name: encoding.tolist() if isinstance(encoding, np.ndarray) else encoding for name, encoding in st.session_state.face_encodings.items()}
+@st.cache_resource
+def get_face_store():
+    """One handle on the shared gallery store (face_data.<n>.f32/.wal + face_data.index.json) per server process.
+
+    Every browser session shares its in-memory gallery, which only replays the
+    changes other processes logged since the last rerun. Several server
+    processes can register faces into the same files at once.
+    """
+    return FaceStore('face_data')
+
+@st.cache_resource
+def get_encoding_service():
+    """Worker process pool for face detection/encoding, shared by every session"""
+    return EncodingService()
+
+@st.cache_resource
+def get_frame_cache():
+    """Encodings of recently seen camera frames, shared by every session"""
+    return FrameCache()
+
+@st.cache_resource
+def get_startup_report():
+    """Cold start timings of this server process, filled in by main() and the model warm-up"""
+    return {}
+
+@st.cache_resource
+def start_model_warmup(_service):
+    """Load the face models in every encoding worker in the background, as soon as a setup is completed.
+
+    All face work runs on the workers, so the first registration does not
+    pay for the model load and this process never loads the models at all.
+    """
+    report = get_startup_report()
+
+    def warm():
+        started = time.perf_counter()
+        try:
+            for future in _service.warm_up():
+                future.result()
+        except Exception:
+            logging.exception("Model warm-up failed, models will load on first use instead")
+            return
+        report["models_warm_seconds"] = time.perf_counter() - started
+        logging.info(f"Face models warm after {report['models_warm_seconds']:.2f}s")
+
+    thread = threading.Thread(target=warm, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def record_startup(page, render_started):
+    """Keep the first run's timings for `page` in this process; later reruns are only sent to metrics"""
+    now = time.perf_counter()
+    metrics.observe(f"{page}_render", now - render_started)
+    report = get_startup_report()
+    if "imports_seconds" not in report:
+        # Only the first script run in a process actually imports the modules
+        report["imports_seconds"] = _imports_seconds
+    report.setdefault(f"{page}_first_paint_seconds", now - _script_started)
+
+def encode_picture(picture, spinner_text, **params):
+    """Encode a camera frame, reusing the result if these exact bytes were already processed.
+
+    Returns (encoding, report, fresh); fresh is False when the result came
+    from the cache, i.e. this is a rerun showing the same photo again.
+    """
+    frame = picture.getvalue()
+    cache_params = {k: v for k, v in params.items() if k != "gallery"}
+    fresh = []
+
+    def compute():
+        with st.spinner(spinner_text), metrics.span("frame"):
+            encoding, report = get_encoding_service().encode(frame, **params)
+        metrics.observe_report(report)
+        metrics.count("detections" if encoding is not None else "no_face")
+        fresh.append(True)
+        return encoding, report
+
+    encoding, report = get_frame_cache().get_or_compute(frame, compute, **cache_params)
+    return encoding, report, bool(fresh)
+
+def save_face_data(name, encoding):
+    """Register a face encoding for a name in the shared gallery and on disk"""
     try:
-        with open('face_data.json', 'w') as f:
-            json.dump(face_data, f)
+        with metrics.span("store_write"):
+            get_face_store().append(name, encoding)
+    except Exception as e:
+        st.error(f"Error saving face data: {str(e)}")
+
+def rename_face_data(old_name, new_name):
+    """Move a stored face encoding to a new name"""
+    try:
+        get_face_store().rename(old_name, new_name)
+    except Exception as e:
+        st.error(f"Error saving face data: {str(e)}")
+
+def remove_face_data(name):
+    """Drop a stored face encoding"""
+    try:
+        get_face_store().remove(name)
     except Exception as e:
         st.error(f"Error saving face data: {str(e)}")
 
 def load_face_data():
-    """Load face encodings from file"""
+    """Point the session at the shared gallery. Only a stat of the index file unless it changed"""
     try:
-        with open('face_data.json', 'r') as f:
-            face_data = json.load(f)
-        st.session_state.face_encodings = {name: np.array(encoding) if isinstance(encoding, list) else encoding for name, encoding in face_data.items()}
-    except FileNotFoundError:
-        pass
+        st.session_state.face_gallery = get_face_store().gallery()
     except Exception as e:
         st.error(f"Error loading face data: {str(e)}")
 
+def bulk_import(exchange):
+    """Import a roster file and enroll faces from a folder or zip of labelled photos in one go"""
+    with st.expander("📥 Bulk import"):
+        roster = st.file_uploader(
+            "Participants and rules (CSV or JSON)",
+            type=["csv", "json"],
+            help="CSV columns: name, cant_gift_to (names separated by ';'), must_gift_to"
+        )
+        if roster is not None and st.button("Import roster"):
+            try:
+                new_exchange, errors = import_roster(exchange, *parse_roster(roster.getvalue(), roster.name))
+            except Exception as e:
+                new_exchange, errors = None, [f"Could not read {roster.name}: {str(e)}"]
+            if errors:
+                st.error("Nothing was imported:\n" + "\n".join(f"- {error}" for error in errors))
+            else:
+                st.session_state.exchange = new_exchange
+                st.success(f"Imported roster: {len(new_exchange.participants)} participants")
+                st.rerun()
+
+        photos = st.file_uploader(
+            "Labelled photos (zip)",
+            type=["zip"],
+            help="Name/photo.jpg or Name.jpg, Name_2.jpg, ... for each participant"
+        )
+        folder = st.text_input("...or a photo folder on the server")
+        if (photos is not None or folder) and st.button("Enroll faces"):
+            progress = st.progress(0.0, text="Enrolling faces...")
+            try:
+                templates, failures = enroll_photos(
+                    photos if photos is not None else folder,
+                    get_encoding_service(),
+                    participants=exchange.participants,
+                    scale=st.session_state.detection_scale,
+                    model=st.session_state.detection_model,
+                    progress=lambda done, total: progress.progress(
+                        done / max(total, 1), text=f"Enrolling faces... {done}/{total}"
+                    )
+                )
+                if templates:
+                    with metrics.span("store_write"):
+                        get_face_store().append_many({name: template for name, (template, _) in templates.items()})
+                    for name in templates:
+                        st.session_state.registration_status[name] = True
+                st.success(f"Enrolled {len(templates)} participant(s)")
+                if failures:
+                    st.warning(f"{len(failures)} photo(s) could not be used")
+                    st.table({"photo": [path for path, _ in failures], "problem": [reason for _, reason in failures]})
+            except Exception as e:
+                st.error(f"An error occurred during bulk enrollment: {str(e)}")
+
+def page_offset(label, total, key):
+    """Page picker for long editor lists; returns the index of the first item to show"""
+    pages = max(1, -(-total // EDITOR_PAGE_SIZE))
+    if pages == 1:
+        return 0
+    page = st.number_input(f"{label} page (of {pages})", min_value=1, max_value=pages, value=1, key=key)
+    return (page - 1) * EDITOR_PAGE_SIZE
+
 def setup_participants():
     st.markdown("""
         <div style='text-align: center; padding: 2rem;'>
@@ -103,6 +267,7 @@ def setup_participants():
         </div>
     """, unsafe_allow_html=True)
 
+    exchange = st.session_state.exchange
     col1, col2 = st.columns(2)
 
     with col1:
@@ -111,39 +276,31 @@ def setup_participants():
         
         if st.button("Add Participants") and new_participants:
             names = [name.strip() for name in new_participants.split(',') if name.strip()]
-            for name in names:
-                if name not in st.session_state.participants:
-                    st.session_state.participants.append(name)
-            st.success(f"Added {len(names)} new participant(s)!")
+            added = exchange.add_participants(names)
+            st.success(f"Added {added} new participant(s)!")
+
+        bulk_import(exchange)
 
         # participant management
         st.markdown("### ✏️ Edit Participants")
-        for i, participant in enumerate(st.session_state.participants):
+        # Only one page of widgets is rendered per rerun
+        names = exchange.registry.names
+        offset = page_offset("Participants", len(names), "participants_page")
+        for i, (pid, participant) in enumerate(list(itertools.islice(names.items(), offset, offset + EDITOR_PAGE_SIZE)), offset):
             col_name, col_remove = st.columns([3, 1])
             with col_name:
-                new_name = st.text_input(f"Participant {i+1}", value=participant, key=f"edit_{i}")
-                if new_name != participant:
-                    # Edit participant names
-                    idx = st.session_state.participants.index(participant)
-                    st.session_state.participants[idx] = new_name
-                    
-                    # edit restrictions
-                    if participant in st.session_state.restrictions:
-                        st.session_state.restrictions[new_name] = st.session_state.restrictions.pop(participant)
-                    for p, restricted in st.session_state.restrictions.items():
-                        if participant in restricted:
-                            restricted[restricted.index(participant)] = new_name
-                    
-                    # Edit mandates
-                    if participant in st.session_state.mandates:
-                        st.session_state.mandates[new_name] = st.session_state.mandates.pop(participant)
-                    for p, mandated in st.session_state.mandates.items():
-                        if mandated == participant:
-                            st.session_state.mandates[p] = new_name
+                # Keyed by participant ID so widgets stay attached to the right person after removals
+                new_name = st.text_input(f"Participant {i+1}", value=participant, key=f"edit_{pid}")
+                if new_name and new_name != participant:
+                    # Rules follow automatically, they are stored by participant ID
+                    try:
+                        exchange.rename_participant(participant, new_name)
+                    except ValueError as e:
+                        st.error(str(e))
+                        continue
                     
                     # Update face encodings
-                    if participant in st.session_state.face_encodings:
-                        st.session_state.face_encodings[new_name] = st.session_state.face_encodings.pop(participant)
+                    rename_face_data(participant, new_name)
                     
                     # Update registration status
                     if participant in st.session_state.registration_status:
@@ -152,114 +309,130 @@ def setup_participants():
                     st.success(f"Updated {participant} to {new_name}")
                     
             with col_remove:
-                if st.button("❌", key=f"remove_{i}"):
-                    st.session_state.participants.remove(participant)
+                if st.button("❌", key=f"remove_{pid}"):
                     # Remove from all data structures
-                    st.session_state.restrictions.pop(participant, None)
-                    st.session_state.mandates.pop(participant, None)
-                    st.session_state.face_encodings.pop(participant, None)
+                    exchange.remove_participant(participant)
+                    remove_face_data(participant)
                     st.session_state.registration_status.pop(participant, None)
                     st.success(f"Removed {participant}")
                     st.rerun()
 
     with col2:
-        if st.session_state.participants:
+        if exchange.participants:
             st.markdown("### 🚫 Set Restrictions & Mandates")
-            person = st.selectbox("Select person", st.session_state.participants, key="restriction_person")
+            person = st.selectbox("Select person", exchange.participants, key="restriction_person")
             restriction_type = st.radio("Rule type", ["Can't gift to", "Must gift to"])
             
             other_person = st.selectbox(
                 "Select other person", 
-                [p for p in st.session_state.participants if p != person],
+                [p for p in exchange.participants if p != person],
                 key="restriction_other"
             )
 
             if st.button("Add Rule"):
                 # Handle "Can't gift to"
                 if restriction_type == "Can't gift to":
-                    if person in st.session_state.mandates and st.session_state.mandates[person] == other_person:
-                        st.error(f"Conflict detected: {person} must gift to {other_person}. Cannot add restriction.")
+                    ok, conflict = exchange.add_restriction(person, other_person)
+                    if not ok:
+                        st.error(f"Conflict detected: {conflict} Cannot add restriction.")
                     else:
-                        if person not in st.session_state.restrictions:
-                            st.session_state.restrictions[person] = []
-                        if other_person not in st.session_state.restrictions[person]:
-                            st.session_state.restrictions[person].append(other_person)
-                            st.success(f"Added restriction: {person} can't gift to {other_person}")
+                        st.success(f"Added restriction: {person} can't gift to {other_person}")
                 
                 # Handle "Must gift to"
                 else:
-                    if person in st.session_state.restrictions and other_person in st.session_state.restrictions[person]:
-                        st.error(f"Conflict detected: {person} can't gift to {other_person}. Cannot add mandate.")
+                    ok, conflict = exchange.add_mandate(person, other_person)
+                    if not ok:
+                        st.error(f"Conflict detected: {conflict} Cannot add mandate.")
                     else:
-                        st.session_state.mandates[person] = other_person
                         st.success(f"Added mandate: {person} must gift to {other_person}")
 
             # Rules management
             st.markdown("### ✏️ Edit Rules")
             st.markdown("#### Restrictions:")
-            for person, restricted in st.session_state.restrictions.items():
-                for restricted_person in restricted:
-                    col_rule, col_remove = st.columns([3, 1])
-                    with col_rule:
-                        st.write(f"{person} can't gift to {restricted_person}")
-                    with col_remove:
-                        if st.button("❌", key=f"remove_restriction_{person}_{restricted_person}"):
-                            st.session_state.restrictions[person].remove(restricted_person)
-                            if not st.session_state.restrictions[person]:
-                                del st.session_state.restrictions[person]
-                            st.success("Restriction removed")
-                            st.rerun()
+            restriction_total = exchange.registry.rule_count() - len(exchange.registry.mandates)
+            offset = page_offset("Restrictions", restriction_total, "restrictions_page")
+            for gid, rid, person, restricted_person in exchange.restriction_page(offset, EDITOR_PAGE_SIZE):
+                col_rule, col_remove = st.columns([3, 1])
+                with col_rule:
+                    st.write(f"{person} can't gift to {restricted_person}")
+                with col_remove:
+                    # Keyed by IDs: name-based keys collide, e.g. A_B -> C and A -> B_C
+                    if st.button("❌", key=f"remove_restriction_{gid}_{rid}"):
+                        exchange.remove_restriction(person, restricted_person)
+                        st.success("Restriction removed")
+                        st.rerun()
 
             st.markdown("#### Mandates:")
-            for person, mandated in st.session_state.mandates.items():
+            offset = page_offset("Mandates", len(exchange.registry.mandates), "mandates_page")
+            for gid, _, person, mandated in exchange.mandate_page(offset, EDITOR_PAGE_SIZE):
                 col_rule, col_remove = st.columns([3, 1])
                 with col_rule:
                     st.write(f"{person} must gift to {mandated}")
                 with col_remove:
-                    if st.button("❌", key=f"remove_mandate_{person}"):
-                        del st.session_state.mandates[person]
+                    if st.button("❌", key=f"remove_mandate_{gid}"):
+                        exchange.remove_mandate(person)
                         st.success("Mandate removed")
                         st.rerun()
 
     # Setup completion
-    if len(st.session_state.participants) >= 2:
-        if st.button("Complete Setup", type="primary"):
+    if len(exchange.participants) >= 2:
+        conflict = exchange.conflict()
+        if conflict:
+            st.warning(f"No valid assignment is possible yet: {conflict}")
+        if st.button("Complete Setup", type="primary", disabled=conflict is not None):
             st.session_state.setup_complete = True
             st.rerun()
 
-def is_valid_combination(combination):
-    """Check if a combination is valid given restrictions and mandates"""
-    for i, (giver, receiver) in enumerate(zip(st.session_state.participants, combination)):
-        # Check self-gifting
-        if giver == receiver:
-            return False
-        
-        # Check restrictions
-        if giver in st.session_state.restrictions and receiver in st.session_state.restrictions[giver]:
-            return False
-        
-        # Check mandates
-        if giver in st.session_state.mandates and st.session_state.mandates[giver] != receiver:
-            return False
-    
-    return True
-
-def generate_combinations():
-    """Generate valid combinations considering restrictions and mandates"""
-    for combination in itertools.permutations(st.session_state.participants):
-        if is_valid_combination(combination):
-            yield combination
-
 def get_random_valid_combination():
     """Get a random valid combination of gift assignments"""
-    if st.session_state.combination is None:
-        valid_combinations = list(generate_combinations())
-        if valid_combinations:
-            combination = random.choice(valid_combinations)
-            st.session_state.combination = combination
-            return True
-        return False
-    return True
+    return st.session_state.exchange.ensure_assignment()
+
+def show_frame_report(report):
+    """Show how long face detection took on the downscaled frame and how many jitters encoding used"""
+    width, height = report["frame_size"]
+    st.caption(
+        f"Detected {report['faces']} face(s) in a {width}x{height} frame in "
+        f"{report['detect_seconds'] * 1000:.0f} ms "
+        f"(scanning {report['pixel_reduction']:.1f}x fewer pixels than full resolution)"
+        + (f", encoded with {report['jitters']} jitter(s)" if "jitters" in report else "")
+    )
+
+def show_verification_result(exchange, selected_name, actual_identity):
+    """Reveal the recipient if the face matched the selected name, otherwise explain what went wrong"""
+    if actual_identity is not None:
+        if actual_identity == selected_name:
+            st.balloons()
+            recipient = exchange.recipient_of(selected_name)
+            
+            st.markdown(f"""
+                <div style='background: linear-gradient(45deg, #85FFBD 0%, #FFFB7D 100%);
+                         padding: 2rem;
+                         border-radius: 15px;
+                         text-align: center;
+                         margin: 2rem 0;'>
+                    <h2 style='color: #1a1a1a;'>🎉 Identity Verified! 🎉</h2>
+                    <h3 style='color: #2937f0;'>You are gifting to:</h3>
+                    <h1 style='color: #1a1a1a; font-size: 3rem;'>{recipient}</h1>
+                    <p style='color: #666;'>Keep it a secret! 🤫</p>
+                </div>
+            """, unsafe_allow_html=True)
+            
+            st.session_state.verified_identity = actual_identity
+        else:
+            st.markdown(
+                f"""<div class='error-message'>
+                    This looks like {actual_identity}, not {selected_name}! 
+                    Please select your correct name.
+                </div>""",
+                unsafe_allow_html=True
+            )
+    else:
+        st.markdown(
+            """<div class='error-message'>
+                Face not recognized. Please try again or register first.
+            </div>""",
+            unsafe_allow_html=True
+        )
 
 def main_game():
     st.markdown("""
@@ -278,7 +451,8 @@ def main_game():
         return
 
 
-    selected_name = st.selectbox("Select your name", st.session_state.participants)
+    exchange = st.session_state.exchange
+    selected_name = st.selectbox("Select your name", exchange.participants)
     tab1, tab2 = st.tabs(["📸 Register Face", "🎁 Check Gift Recipient"])
 
     with tab1:
@@ -301,20 +475,22 @@ def main_game():
         
         if picture is not None:
             try:
-                image = Image.open(picture)
-                image_array = np.array(image)
-                face_locations = face_recognition.face_locations(image_array)
+                face_encoding, report, _ = encode_picture(
+                    picture,
+                    "Analyzing your photo...",
+                    num_jitters=6,  # upper bound, stops early once the encoding settles
+                    scale=st.session_state.detection_scale,
+                    model=st.session_state.detection_model
+                )
+                show_frame_report(report)
                 
-                if face_locations:
-                    # Face detection with multiple attempts
-                    face_encoding = face_recognition.face_encodings(
-                        image_array, 
-                        face_locations,
-                        num_jitters=6  # multiple samples for better accuracy
-                    )[0]
-                    st.session_state.face_encodings[selected_name] = face_encoding.tolist()
+                if face_encoding is not None:
                     st.session_state.registration_status[selected_name] = True
-                    save_face_data()
+                    # The same photo comes back on every rerun; only store it once
+                    saved_frame = (selected_name, frame_key(picture.getvalue()))
+                    if st.session_state.get('last_registered_frame') != saved_frame:
+                        save_face_data(selected_name, face_encoding)
+                        st.session_state.last_registered_frame = saved_frame
                     st.markdown(
                         f"""<div class='success-message'>
                             Face registered successfully for {selected_name}!
@@ -333,6 +509,52 @@ def main_game():
                         </div>""",
                         unsafe_allow_html=True
                     )
+            except EncodingServiceBusy as e:
+                st.warning(str(e))
+            except TimeoutError:
+                st.error("Face analysis took too long. Please try again.")
+            except Exception as e:
+                st.error(f"An error occurred during registration: {str(e)}")
+
+        # Several photos or a short clip give a steadier template than one snapshot
+        uploads = st.file_uploader(
+            "Or upload several photos or a short video clip",
+            type=["jpg", "jpeg", "png", *VIDEO_TYPES],
+            accept_multiple_files=True,
+            key=f"enroll_uploads_{selected_name}"
+        )
+        
+        if uploads and st.button("Register from uploads"):
+            try:
+                # Decoding and encoding run on a worker, like every other face check
+                with st.spinner("Processing uploads..."):
+                    encodings, report = get_encoding_service().encode_uploads(
+                        uploads,
+                        scale=st.session_state.detection_scale,
+                        model=st.session_state.detection_model
+                    )
+                
+                if encodings:
+                    template, used = aggregate_template(encodings)
+                    st.session_state.registration_status[selected_name] = True
+                    save_face_data(selected_name, template)
+                    st.markdown(
+                        f"""<div class='success-message'>
+                            Face registered successfully for {selected_name} from {used} of {report['images']} frames!
+                        </div>""",
+                        unsafe_allow_html=True
+                    )
+                else:
+                    st.markdown(
+                        """<div class='error-message'>
+                            No face detected in any of the uploaded frames.
+                        </div>""",
+                        unsafe_allow_html=True
+                    )
+            except EncodingServiceBusy as e:
+                st.warning(str(e))
+            except TimeoutError:
+                st.error("Processing the uploads took too long. Please try fewer or shorter files.")
             except Exception as e:
                 st.error(f"An error occurred during registration: {str(e)}")
 
@@ -351,70 +573,35 @@ def main_game():
             
             if verify_picture is not None:
                 try:
-                    verify_image = Image.open(verify_picture)
-                    verify_array = np.array(verify_image)
-                    verify_face_locations = face_recognition.face_locations(verify_array)
-                    verify_encoding = None
+                    verify_encoding, report, fresh = encode_picture(
+                        verify_picture,
+                        "Verifying your identity...",
+                        num_jitters=3,  # upper bound, clear matches stop after one pass
+                        scale=st.session_state.detection_scale,
+                        model=st.session_state.detection_model,
+                        gallery=st.session_state.face_gallery,
+                        tolerance=0.6
+                    )
+                    show_frame_report(report)
                     
-                    if verify_face_locations:
-                        verify_encoding = face_recognition.face_encodings(
-                            verify_array,
-                            verify_face_locations,
-                            num_jitters=3
-                        )[0]
+                    if verify_encoding is not None:
                         
-                        found_match = False
-                        actual_identity = None
-                        registered_encoding = None
-                        
-                        for name, stored_encoding in st.session_state.face_encodings.items():
-                            registered_encoding = np.array(stored_encoding)
-                            matches = face_recognition.compare_faces(
-                                [registered_encoding],
+                        # Closest registered face wins, not the first one under tolerance
+                        with metrics.span("match"):
+                            actual_identity, distance = st.session_state.face_gallery.identify(
                                 verify_encoding,
                                 tolerance=0.6  # Adjusted tolerance for better accuracy
                             )
-                            
-                            if matches[0]:
-                                found_match = True
-                                actual_identity = name
-                                break
-                        
-                        if found_match:
-                            if actual_identity == selected_name:
-                                st.balloons()
-                                recipient_idx = st.session_state.participants.index(selected_name)
-                                recipient = st.session_state.combination[recipient_idx]
-                                
-                                st.markdown(f"""
-                                    <div style='background: linear-gradient(45deg, #85FFBD 0%, #FFFB7D 100%);
-                                             padding: 2rem;
-                                             border-radius: 15px;
-                                             text-align: center;
-                                             margin: 2rem 0;'>
-                                        <h2 style='color: #1a1a1a;'>🎉 Identity Verified! 🎉</h2>
-                                        <h3 style='color: #2937f0;'>You are gifting to:</h3>
-                                        <h1 style='color: #1a1a1a; font-size: 3rem;'>{recipient}</h1>
-                                        <p style='color: #666;'>Keep it a secret! 🤫</p>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                                
-                                st.session_state.verified_identity = actual_identity
+                        if fresh:
+                            if actual_identity is None:
+                                metrics.count("unrecognized")
+                            elif actual_identity != selected_name:
+                                metrics.count("mismatches")
                             else:
-                                st.markdown(
-                                    f"""<div class='error-message'>
-                                        This looks like {actual_identity}, not {selected_name}! 
-                                        Please select your correct name.
-                                    </div>""",
-                                    unsafe_allow_html=True
-                                )
-                        else:
-                            st.markdown(
-                                """<div class='error-message'>
-                                    Face not recognized. Please try again or register first.
-                                </div>""",
-                                unsafe_allow_html=True
-                            )
+                                metrics.count("verifications")
+                        logging.info(f"Closest registered face: {actual_identity} at distance {distance:.3f}")
+                        
+                        show_verification_result(exchange, selected_name, actual_identity)
                     else:
                         st.markdown(
                             """<div class='error-message'>
@@ -422,13 +609,60 @@ def main_game():
                             </div>""",
                             unsafe_allow_html=True
                         )
+                except EncodingServiceBusy as e:
+                    st.warning(str(e))
+                except TimeoutError:
+                    st.error("Face analysis took too long. Please try again.")
                 except Exception as e:
                     st.error(f"An error occurred during verification: {str(e)}")
+            
+            # A short clip instead of retaking snapshots: detection runs on keyframes only, the face is
+            # tracked in between and only sharper frames are encoded (see streaming.py)
+            with st.expander("🎥 Verify with a short video"):
+                source = st.radio("Video source", ["Upload a clip", "Camera on this machine"], horizontal=True)
+                if source == "Upload a clip":
+                    clip = st.file_uploader("A few seconds of your face", type=list(VIDEO_TYPES), key=f"verify_clip_{selected_name}")
+                else:
+                    clip = st.number_input("Camera index", min_value=0, value=0, step=1)
+                
+                if clip is not None and st.button("Verify from video"):
+                    try:
+                        with st.spinner("Looking for your face..."):
+                            actual_identity, distance, report = get_encoding_service().verify_clip(
+                                clip,
+                                st.session_state.face_gallery,
+                                tolerance=0.6,
+                                scale=st.session_state.detection_scale,
+                                model=st.session_state.detection_model
+                            )
+                        metrics.observe("stream_verify", report["seconds"])
+                        metrics.count("stream_detections", report["detections"])
+                        metrics.count("stream_encodings", report["encodings"])
+                        st.caption(
+                            f"Read {report['frames']} frames in {report['seconds']:.1f}s: {report['detections']} detections, "
+                            f"{report['tracked']} tracked, {report['encodings']} encoded"
+                        )
+                        if report["encodings"]:
+                            logging.info(f"Closest registered face: {actual_identity} at distance {distance:.3f}")
+                            show_verification_result(exchange, selected_name, actual_identity)
+                        else:
+                            st.markdown(
+                                """<div class='error-message'>
+                                    No face detected in the video. Please try again.
+                                </div>""",
+                                unsafe_allow_html=True
+                            )
+                    except EncodingServiceBusy as e:
+                        st.warning(str(e))
+                    except TimeoutError:
+                        st.error("Video analysis took too long. Please try a shorter clip.")
+                    except Exception as e:
+                        st.error(f"An error occurred during video verification: {str(e)}")
 
     # Reshuffle combination button
     if st.button("🔄 Reshuffle Assignments", type="primary"):
-        st.session_state.combination = None
-        if get_random_valid_combination():
+        metrics.count("reshuffles")
+        if exchange.reshuffle():
             st.markdown("""
                 <div class='success-message'>
                     🎲 Gift assignments have been reshuffled successfully!
@@ -452,10 +686,85 @@ with st.sidebar:
     with st.expander("📊 System Status"):
         st.write("Registered Users:", list(st.session_state.registration_status.keys()))
         st.write("Currently Verified as:", st.session_state.verified_identity)
-        st.write("Total Participants:", len(st.session_state.participants))
+        st.write("Total Participants:", len(st.session_state.exchange.participants))
+        st.write("Face checks in progress:", get_encoding_service().pending)
+        startup = get_startup_report()
+        st.write("Face models warm:", "models_warm_seconds" in startup)
+        if startup:
+            st.write("Startup (s):", {key[: -len("_seconds")]: round(value, 3) for key, value in startup.items()})
+        cache_stats = get_frame_cache().stats()
+        st.write(
+            "Frame cache:",
+            f"{cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} frames, "
+            f"{cache_stats['bytes'] / 1024:.0f} KiB"
+        )
     
+    # Per-stage latency of the face pipeline
+    with st.expander("⏱️ Metrics"):
+        # One switch for the whole server process, so it only changes on an explicit click
+        st.caption(f"Metrics collection is {'on' if metrics.enabled else 'off'} for every session")
+        if st.button("Stop Collecting Metrics" if metrics.enabled else "Start Collecting Metrics"):
+            metrics.enabled = not metrics.enabled
+            st.rerun()
+        snapshot = metrics.snapshot()
+        if snapshot["stages"]:
+            st.table({
+                stage: {
+                    "count": values["count"],
+                    "mean ms": round(values["mean_seconds"] * 1000, 1),
+                    "p95 ms ≤": values["p95_seconds"] * 1000,
+                }
+                for stage, values in snapshot["stages"].items()
+            })
+        if snapshot["counters"]:
+            st.write(snapshot["counters"])
+        st.download_button(
+            label="Download Prometheus metrics",
+            data=metrics.to_prometheus(),
+            file_name="secret_gift_metrics.prom",
+            mime="text/plain"
+        )
+        st.download_button(
+            label="Download JSON snapshot",
+            data=json.dumps(snapshot, indent=2),
+            file_name=f'metrics_snapshot_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json',
+            mime="application/json"
+        )
+        if st.button("Reset Metrics"):
+            metrics.reset()
+            st.rerun()
+
     # Admin controls
     with st.expander("⚙️ Admin Controls"):
+        st.slider(
+            "Detection scale",
+            min_value=0.25, max_value=1.0, step=0.05,
+            key="detection_scale",
+            help="Faces are detected on a copy scaled by this factor. Lower is faster but misses small faces."
+        )
+        st.selectbox(
+            "Detection model",
+            DETECTION_MODELS,
+            key="detection_model",
+            help="hog runs on CPU, cnn is more accurate but needs a GPU"
+        )
+        
+        exchange = st.session_state.exchange
+        exchange.sampler = st.selectbox(
+            "Assignment mode",
+            SAMPLERS,
+            index=SAMPLERS.index(exchange.sampler),
+            help="uniform: every valid assignment is equally likely. fast: any valid assignment. "
+                 "history: avoid last years' pairs and reversed pairs (applies from the next shuffle)"
+        )
+        if exchange.assignment is not None and st.button("Record Assignment in History"):
+            try:
+                record_assignment(exchange.pairs())
+                st.success("Assignment recorded, the history mode will avoid these pairs next time")
+            except Exception as e:
+                st.error(f"Error recording assignment: {str(e)}")
+        
         if st.button("Reset All Data"):
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
@@ -467,10 +776,7 @@ with st.sidebar:
             try:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f'face_data_backup_{timestamp}.json'
-                face_data = {
-                    name: encoding.tolist() if isinstance(encoding, np.ndarray) else encoding
-                    for name, encoding in st.session_state.face_encodings.items()
-                }
+                face_data = st.session_state.face_gallery.to_dict()
                 st.download_button(
                     label="Download Face Data Backup",
                     data=json.dumps(face_data),
@@ -481,12 +787,16 @@ with st.sidebar:
                 st.error(f"Error exporting face data: {str(e)}")
 
 def main():
-    load_face_data()  # Load saved face data at startup. Empty file will show `Expecting value: line 1 column 1 (char 0)`
+    render_started = time.perf_counter()
+    load_face_data()  # Shared across sessions and reruns, only reloaded when the store changes on disk
     
     if not st.session_state.setup_complete:
         setup_participants()
+        record_startup("setup", render_started)
     else:
+        start_model_warmup(get_encoding_service())
         main_game()
+        record_startup("game", render_started)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
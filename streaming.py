@@ -0,0 +1,153 @@
+import logging
+import os
+import tempfile
+import time
+
+import cv2
+from PIL import Image
+
+from vision import (
+    DEFAULT_DETECTION_MODEL, DEFAULT_DETECTION_SCALE, crop_to_face, detect_faces, encode_adaptive, largest_face
+)
+
+# Full face detection runs at most every this many frames; the box is tracked in between
+KEYFRAME_INTERVAL = 10
+# Below this normalized correlation the tracker counts the face as lost and the next frame is a keyframe
+TRACK_MIN_SCORE = 0.6
+# The tracker searches this fraction of the box size around its last position
+TRACK_SEARCH_MARGIN = 0.5
+# Tracking compares downscaled patches with the face this many pixels wide
+TRACK_FACE_WIDTH = 48
+# Faces narrower than this (in pixels) get a proportionally lower quality score
+QUALITY_FULL_WIDTH = 150
+# A frame is only encoded if its quality beats the best encoded frame so far by this factor
+QUALITY_GAIN = 1.15
+# Stop reading frames once the best match is this far inside the tolerance
+CONFIDENT_MARGIN = 0.1
+STREAM_MAX_FRAMES = 300
+
+logger = logging.getLogger(__name__)
+
+
+def iter_video(source, max_frames=STREAM_MAX_FRAMES):
+    """Yield up to `max_frames` RGB arrays from a camera index, a video file path or an uploaded clip"""
+    path = None
+    if hasattr(source, "getvalue"):
+        suffix = os.path.splitext(getattr(source, "name", ""))[1] or ".mp4"
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(source.getvalue())
+            path = source = f.name
+    capture = cv2.VideoCapture(source)
+    try:
+        for _ in range(max_frames):
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        capture.release()
+        if path is not None:
+            os.remove(path)
+
+
+def frame_quality(gray, box):
+    """Sharpness of the face (variance of the Laplacian), discounted for small faces"""
+    top, right, bottom, left = box
+    face = gray[top:bottom, left:right]
+    if face.size == 0:
+        return 0.0
+    sharpness = cv2.Laplacian(face, cv2.CV_64F).var()
+    return sharpness * min(1.0, (right - left) / QUALITY_FULL_WIDTH)
+
+
+class FaceTracker:
+    """Follows one face box between keyframes by template matching around its last position.
+
+    The template is taken on the keyframe and not updated while tracking, so
+    errors do not accumulate; a poor match hands control back to detection.
+    """
+
+    def __init__(self, gray, box):
+        top, right, bottom, left = box
+        self.box = box
+        self.scale = TRACK_FACE_WIDTH / max(1, right - left)
+        self.template = cv2.resize(
+            gray[top:bottom, left:right], None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA
+        )
+
+    def update(self, gray):
+        """Locate the face in a new frame. Returns (box, score); box is None when the face was lost"""
+        top, right, bottom, left = self.box
+        height, width = bottom - top, right - left
+        pad_y, pad_x = int(height * TRACK_SEARCH_MARGIN), int(width * TRACK_SEARCH_MARGIN)
+        y0, x0 = max(0, top - pad_y), max(0, left - pad_x)
+        y1, x1 = min(gray.shape[0], bottom + pad_y), min(gray.shape[1], right + pad_x)
+        window = cv2.resize(gray[y0:y1, x0:x1], None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if window.shape[0] < self.template.shape[0] or window.shape[1] < self.template.shape[1]:
+            return None, 0.0
+        _, score, _, (x, y) = cv2.minMaxLoc(cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED))
+        if score < TRACK_MIN_SCORE:
+            return None, score
+        top, left = y0 + int(round(y / self.scale)), x0 + int(round(x / self.scale))
+        self.box = (top, left + width, top + height, left)
+        return self.box, score
+
+
+def verify_stream(frames, gallery, tolerance=0.6, keyframe_interval=KEYFRAME_INTERVAL,
+                  scale=DEFAULT_DETECTION_SCALE, model=DEFAULT_DETECTION_MODEL):
+    """Identify the person in a stream of RGB frames with as little detection and encoding as possible.
+
+    Faces are detected on keyframes only and tracked in between; a frame is
+    encoded only when its face is sharper than the best one encoded so far,
+    and reading stops as soon as a match is CONFIDENT_MARGIN inside
+    `tolerance`. Returns (name, distance, report); name is None when no
+    encoded frame was within tolerance. report counts frames read,
+    detections, tracked frames and encodings.
+    """
+    started = time.perf_counter()
+    report = {"frames": 0, "detections": 0, "tracked": 0, "encodings": 0, "confident": False}
+    best_name, best_distance = None, float("inf")
+    best_quality = 0.0
+    tracker = None
+    since_keyframe = 0
+
+    for rgb in frames:
+        report["frames"] += 1
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        box = None
+        if tracker is not None and since_keyframe < keyframe_interval:
+            box, _ = tracker.update(gray)
+            if box is not None:
+                report["tracked"] += 1
+                since_keyframe += 1
+        if box is None:
+            report["detections"] += 1
+            boxes = detect_faces(Image.fromarray(rgb), scale, model)
+            if not boxes:
+                tracker = None
+                continue
+            box = largest_face(boxes)
+            tracker = FaceTracker(gray, box)
+            since_keyframe = 1
+
+        quality = frame_quality(gray, box)
+        if quality <= best_quality * QUALITY_GAIN:
+            continue
+        best_quality = quality
+        crop, local_box = crop_to_face(rgb, box)
+        # One plain pass per frame: the next sharper frame is worth more than jittering this one
+        encoding, _ = encode_adaptive(crop, local_box, 1)
+        report["encodings"] += 1
+        name, distance = gallery.identify(encoding, tolerance)
+        if distance < best_distance:
+            best_name, best_distance = name, distance
+        if name is not None and distance <= tolerance - CONFIDENT_MARGIN:
+            report["confident"] = True
+            break
+
+    report["seconds"] = time.perf_counter() - started
+    logger.info(
+        f"Stream verification: {best_name} at {best_distance:.3f} after {report['frames']} frames, "
+        f"{report['detections']} detections, {report['tracked']} tracked, {report['encodings']} encodings"
+    )
+    return best_name, best_distance, report
@@ -0,0 +1,269 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+# Detection runs on a copy scaled by this factor; boxes are mapped back to full resolution
+DEFAULT_DETECTION_SCALE = 0.5
+# "hog" is the CPU detector, "cnn" is more accurate but needs a GPU to be usable
+DEFAULT_DETECTION_MODEL = "hog"
+DETECTION_MODELS = ("hog", "cnn")
+# Extra context kept around the face when cropping, as a fraction of the box size
+CROP_MARGIN = 0.5
+# Adaptive encoding: jittered resamples added per round once the first plain pass is not enough
+JITTER_STEP = 2
+# Stop adding jitters once the running mean encoding moves less than this per round
+JITTER_CONVERGENCE = 0.01
+# Keep jittering while the best gallery distance is this close to the match tolerance
+JITTER_AMBIGUITY_MARGIN = 0.08
+# Enrollment: frames sampled from an uploaded clip, and samples further than this from the
+# per-person median are treated as someone else (or a bad frame) and left out of the template
+ENROLL_MAX_FRAMES = 12
+ENROLL_OUTLIER_DISTANCE = 0.5
+VIDEO_TYPES = ("mp4", "mov", "avi", "webm")
+
+logger = logging.getLogger(__name__)
+
+# face_recognition pulls in dlib and reads its model files (~100 MB) on import, so it is only
+# imported the first time a face is actually processed; see models()
+_face_recognition = None
+_models_lock = threading.Lock()
+
+
+def models():
+    """The face_recognition module, importing it (and loading dlib's models) on first use.
+
+    Thread-safe: a background warm-up and a user's first frame never load the
+    models twice.
+    """
+    global _face_recognition
+    if _face_recognition is None:
+        with _models_lock:
+            if _face_recognition is None:
+                started = time.perf_counter()
+                import face_recognition
+                _face_recognition = face_recognition
+                logger.info(f"Loaded face models in {time.perf_counter() - started:.2f}s")
+    return _face_recognition
+
+
+def warm_up():
+    """Load the models and run one throwaway detection and encoding so the first real frame is not slower.
+
+    Returns the seconds it took.
+    """
+    started = time.perf_counter()
+    face_recognition = models()
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    face_recognition.face_encodings(blank, [(8, 56, 56, 8)])
+    return time.perf_counter() - started
+
+
+def load_rgb(picture):
+    """Decode an uploaded frame into a PIL image in RGB, whatever mode it came in"""
+    image = Image.open(picture)
+    if image.mode != "RGB":
+        # RGBA, grayscale and palette frames are converted once, here
+        image = image.convert("RGB")
+    return image
+
+
+def detect_faces(image, scale=DEFAULT_DETECTION_SCALE, model=DEFAULT_DETECTION_MODEL):
+    """Find face boxes on a downscaled copy and return them in full-resolution (top, right, bottom, left)"""
+    width, height = image.size
+    if scale < 1.0:
+        small = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+    else:
+        scale = 1.0
+        small = image
+    boxes = models().face_locations(np.asarray(small), model=model)
+    return [
+        (
+            max(0, int(top / scale)),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(left / scale)),
+        )
+        for top, right, bottom, left in boxes
+    ]
+
+
+def largest_face(boxes):
+    """Pick the box with the biggest area"""
+    return max(boxes, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+
+
+def crop_to_face(image_array, box, margin=CROP_MARGIN):
+    """Cut the face plus some margin out of the frame and return the crop with the box relative to it"""
+    top, right, bottom, left = box
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    height, width = image_array.shape[:2]
+    y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+    x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+    crop = np.ascontiguousarray(image_array[y0:y1, x0:x1])
+    return crop, (top - y0, right - x0, bottom - y0, left - x0)
+
+
+def encode_adaptive(image_array, box, max_jitters, gallery=None, tolerance=0.6):
+    """Encode a face with as few jitters as it takes, up to `max_jitters`.
+
+    Starts from one plain pass and adds JITTER_STEP jittered resamples at a
+    time to a running mean. Stops once the mean stops moving, or, when a
+    gallery is given, as soon as the closest match is clearly inside or
+    outside `tolerance`. Returns (encoding, jitters_spent).
+    """
+    face_recognition = models()
+    encoding = face_recognition.face_encodings(image_array, [box], num_jitters=1)[0]
+    spent = 1
+    movement = None
+    while max_jitters - spent >= 2:
+        settled = movement is not None and movement < JITTER_CONVERGENCE
+        if settled:
+            break
+        if gallery is not None:
+            _, distance = gallery.identify(encoding, tolerance)
+            if abs(distance - tolerance) > JITTER_AMBIGUITY_MARGIN:
+                break
+        # dlib only jitters when asked for two or more samples, and returns their mean
+        batch = min(JITTER_STEP, max_jitters - spent)
+        sample = face_recognition.face_encodings(image_array, [box], num_jitters=batch)[0]
+        updated = (encoding * spent + sample * batch) / (spent + batch)
+        movement = float(np.linalg.norm(updated - encoding))
+        encoding = updated
+        spent += batch
+    return encoding, spent
+
+
+def encode_frame(picture, num_jitters=1, scale=DEFAULT_DETECTION_SCALE, model=DEFAULT_DETECTION_MODEL,
+                 adaptive=True, gallery=None, tolerance=0.6):
+    """Detect the largest face in a frame and encode it.
+
+    Returns (encoding, report). encoding is None when no face was found.
+    report holds the frame size, per-stage timings (`*_seconds`), the pixel
+    reduction the downscaled detection bought for this frame and the number
+    of jitters spent. With `adaptive`, `num_jitters` is an upper bound and
+    `gallery`/`tolerance` let a clear match stop after a single pass.
+    """
+    started = time.perf_counter()
+    image = load_rgb(picture)
+    decoded = time.perf_counter()
+    boxes = detect_faces(image, scale, model)
+    detected = time.perf_counter()
+
+    effective_scale = min(scale, 1.0)
+    report = {
+        "frame_size": image.size,
+        "faces": len(boxes),
+        "decode_seconds": decoded - started,
+        "detect_seconds": detected - decoded,
+        # How many times fewer pixels detection scanned than the full frame; not a measured speed-up
+        "pixel_reduction": 1.0 / (effective_scale * effective_scale),
+    }
+    if not boxes:
+        logger.info(f"No face found in {image.size} frame, detection took {report['detect_seconds']:.3f}s")
+        return None, report
+
+    crop, box = crop_to_face(np.asarray(image), largest_face(boxes))
+    cropped = time.perf_counter()
+    report["to_array_seconds"] = cropped - detected
+    if adaptive:
+        encoding, jitters = encode_adaptive(crop, box, num_jitters, gallery, tolerance)
+    else:
+        encoding, jitters = models().face_encodings(crop, [box], num_jitters=num_jitters)[0], num_jitters
+    report["jitters"] = jitters
+    report["encode_seconds"] = time.perf_counter() - cropped
+    logger.info(
+        f"Frame {image.size}: detection {report['detect_seconds']:.3f}s on a {effective_scale:.2f}x copy "
+        f"(~{report['pixel_reduction']:.1f}x fewer pixels), encoding {report['encode_seconds']:.3f}s "
+        f"with {jitters}/{num_jitters} jitters"
+    )
+    return encoding, report
+
+
+def video_frames(clip, max_frames=ENROLL_MAX_FRAMES):
+    """Sample up to `max_frames` evenly spaced RGB frames from an uploaded video clip"""
+    import cv2  # only needed for clips
+
+    suffix = os.path.splitext(getattr(clip, "name", ""))[1] or ".mp4"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(clip.getvalue())
+        path = f.name
+    frames = []
+    try:
+        capture = cv2.VideoCapture(path)
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or max_frames
+        wanted = {round(i * (total - 1) / max(1, max_frames - 1)) for i in range(min(max_frames, total))}
+        position = 0
+        while len(frames) < len(wanted):
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if position in wanted:
+                frames.append(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+            position += 1
+        capture.release()
+    finally:
+        os.remove(path)
+    return frames
+
+
+def encode_batch(images, num_jitters=1, scale=DEFAULT_DETECTION_SCALE, model=DEFAULT_DETECTION_MODEL):
+    """Encode the largest face of every image with one batched call to the dlib encoder.
+
+    Returns (encodings, report); images without a face are skipped and
+    counted in report["no_face"].
+    """
+    import dlib  # loaded along with the models, see models()
+
+    face_recognition = models()
+    started = time.perf_counter()
+    crops, landmarks = [], []
+    for image in images:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        boxes = detect_faces(image, scale, model)
+        if not boxes:
+            continue
+        crop, box = crop_to_face(np.asarray(image), largest_face(boxes))
+        crops.append(crop)
+        shapes = dlib.full_object_detections()
+        shapes.append(face_recognition.api._raw_face_landmarks(crop, [box], model="small")[0])
+        landmarks.append(shapes)
+    detected = time.perf_counter()
+
+    encodings = []
+    if crops:
+        # Batched form of what face_recognition.face_encodings does for one image
+        descriptors = face_recognition.api.face_encoder.compute_face_descriptor(crops, landmarks, num_jitters)
+        encodings = [np.array(faces[0]) for faces in descriptors]
+    report = {
+        "images": len(images),
+        "no_face": len(images) - len(crops),
+        "detect_seconds": detected - started,
+        "encode_seconds": time.perf_counter() - detected,
+    }
+    logger.info(
+        f"Enrollment batch: {len(encodings)}/{len(images)} faces, detection {report['detect_seconds']:.3f}s, "
+        f"encoding {report['encode_seconds']:.3f}s"
+    )
+    return encodings, report
+
+
+def aggregate_template(encodings, outlier_distance=ENROLL_OUTLIER_DISTANCE):
+    """Average several encodings of one person into a single template.
+
+    Samples far from the coordinate-wise median (another face in the burst,
+    a badly blurred frame) are dropped first. Returns (template, samples_used).
+    """
+    samples = np.asarray(encodings, dtype=np.float64)
+    median = np.median(samples, axis=0)
+    keep = np.linalg.norm(samples - median, axis=1) <= outlier_distance
+    if not keep.any():
+        keep[:] = True
+    return samples[keep].mean(axis=0), int(keep.sum())